@@ -1,21 +1,66 @@
 import logging
-import pygame
-import Queue
+import time
 
+from backend import createBackend
+from phrases import CONCAT, RenderCache, renderPhrase
+from sequencer import Sequencer
+from pipeline.messages import AudioCommand
+from pipeline.realtime import applyScheduling, enterRealtime
+from pipeline.tracing import ChromeTraceWriter
 
-# This is the queue into which we publish sound request events
-audio_queue = Queue.Queue()
 
-
-def audio_controller_worker(config, queue_list):
+def audio_controller_worker(config, queue_list, heartbeat=None):
     """
     config is an array of dict objects:
 
     [ {'name': 'piano', 'sound': 'piano2.wav', 'loopable': False } ]
 
+    Long, rarely played files can be streamed from disk rather than decoded up front by
+    adding 'stream': True (or 'stream': 'mmap' to read through a memory map) to the item.
+
+    Cues (sounds played at offsets from each other) can be added with 'cue_list':
+
+    [ {'name': 'power_up', 'sounds': [{'name': 'startup_sweep', 'offset': 0.0},
+                                      {'name': 'all_systems_nominal', 'offset': 4.5}]} ]
+
+    'backend' selects how sounds are played:  'pygame' (the default), 'null' for a headless
+    machine, or an AudioBackend instance (see backend.py).
+
+    'trace_path' names a file where traced commands are written as Chrome trace-event json
+    (see pipeline/tracing.py).
+
+    Phrases (announcements made of registered fragments, rendered once into a single sound)
+    can be added with 'phrase_list'.  'mode' is 'concat' (the default) or 'overlay', and
+    'prerender' renders the phrase at startup instead of on first use:
+
+    [ {'name': 'scan_completed_radar_engaged', 'fragments': ['scan_completed', 'radar_engaged'],
+       'gap': 0.1, 'prerender': True} ]
+
+    Only registered phrases are rendered.  'phrase_cache_bytes' bounds the memory used by
+    rendered phrases (default 8 MB).
+
+    'pcm_cache_path' names a directory where decoded sounds are cached, so that a warm start
+    skips decoding (see pcmcache.py).
+
+    'realtime' pins the worker to a CPU and gives it real-time priority before the mixer
+    starts, so that both this thread (which consumes the queues) and the mixer thread SDL
+    starts (which mixes the sound) inherit them.  Other threads which were already running
+    keep their own settings.  Memory is locked and the garbage collector quieted once the
+    sounds are loaded (see pipeline/realtime.py).
+
+    'idle_sleep' is how long the consume loop sleeps when a pass found nothing to do
+    (default 1 ms), so that it doesn't spin on a core at real-time priority.
+
+    heartbeat is an optional pipeline.supervisor.Heartbeat, beaten from the consume loop
     """
+    realtime = config.get('realtime')
+    scheduling = None
+    if realtime:
+        scheduling = applyScheduling(realtime, 'audio')
     ac = AudioController(config, queue_list)
-    ac.consumeMessages()
+    if realtime:
+        enterRealtime(realtime, 'audio', scheduling)
+    ac.consumeMessages(heartbeat)
 
 
 class AudioController:
@@ -23,17 +68,20 @@ class AudioController:
 
     @staticmethod
     def isValidAudioCommand(audio_message):
-        """Returns true if the passed in audio message dict is a properly structured audio message
-        Does not care if the given message is registered properly, just checks the dictionary 
-        for the proper keys
+        """Returns true if the passed in audio message is a properly structured audio message
+        Does not care if the given message is registered properly.  AudioCommands are validated
+        when they're constructed, so only dictionaries need their keys checked
         
         Arguments:
-            audio_message {keys} -- Audio message suitable for playing
+            audio_message {AudioCommand} -- Audio message suitable for playing
         """
         if not audio_message:
             logging.error('None type passed to isValidAudioCommand')
             return False
 
+        if isinstance(audio_message, AudioCommand):
+            return True
+
         if type(audio_message) is not dict:
             logging.error('type of passed in audio_message is %s' % type(audio_message))
             return False
@@ -60,8 +108,7 @@ class AudioController:
         return False
 
     def __init__(self, config, message_queue_list):
-        pygame.init()
-        pygame.mixer.init()
+        self._backend = createBackend(config)
 
         self._audio_registry = {}
 
@@ -80,74 +127,302 @@ class AudioController:
                 sound = "%s/%s.wav" % (self._default_audio_path, item['name'])
             else:
                 sound = item['sound']
-            self.__register(item['name'], sound, item['loopable'])
+            self.__register(item['name'], sound, item['loopable'], item.get('stream', False))
 
         # This is a list of messages queues from which we should be consuming messagess
         self._queue_list = message_queue_list
 
-    def __register(self, registry_name, file_path, loopable=False):
+        # Cues are played by name, just like registered sounds.  Jitter is acceptable
+        # as long as a sound starts within one mixer buffer of its scheduled time
+        self._cue_registry = {}
+        for cue in config.get('cue_list', []):
+            self._cue_registry[cue['name']] = cue['sounds']
+
+        # Phrases are rendered on first use (or now, if prerendered), and cached by fragment list
+        self._render_cache = RenderCache(self._backend, config.get('phrase_cache_bytes', 8 * 1024 * 1024))
+        self._phrase_registry = {}
+        for phrase in config.get('phrase_list', []):
+            self._phrase_registry[phrase['name']] = phrase
+            if phrase.get('prerender'):
+                self.__phraseHandle(phrase)
+
+        # Commands handled so far, so consumeMessages can tell an idle pass from a busy one
+        self.commandsHandled = 0
+        self._idle_sleep = config.get('idle_sleep', 0.001)
+
+        self._trace_writer = None
+        if config.get('trace_path'):
+            self._trace_writer = ChromeTraceWriter(config['trace_path'])
+
+        self._sequencer = Sequencer(self.__playRegistered,
+                                    tick_seconds=config.get('sequencer_tick', 0.01),
+                                    jitter_budget=self._backend.getBufferSeconds(),
+                                    clock=self._backend.now,
+                                    stop_callback=self.stopSound)
+
+    def __register(self, registry_name, file_path, loopable=False, stream=False):
         self._audio_registry[registry_name] = {
-            'sound': pygame.mixer.Sound(file_path),
+            'sound': self._backend.load(file_path, stream),
             'loopable': loopable
             }
 
-    def consumeMessages(self):
+    @staticmethod
+    def __phraseKey(phrase):
+        return (tuple(phrase['fragments']), phrase.get('mode', CONCAT), phrase.get('gap', 0.0))
+
+    def __phraseHandle(self, phrase):
+        """Returns the rendered sound for a phrase, rendering it if it isn't cached
+
+        Returns:
+            {object} -- Backend handle, or None if the phrase can't be rendered
+        """
+        key = AudioController.__phraseKey(phrase)
+        handle = self._render_cache.get(key)
+        if handle is not None:
+            return handle
+
+        try:
+            pcm_list = [self._backend.getPcm(self._audio_registry[fragment]['sound'])
+                        for fragment in phrase['fragments']]
+            pcm = renderPhrase(pcm_list, key[1], self._backend.getPcmFormat(), key[2])
+        except KeyError as err:
+            logging.error('Phrase [%s] has an unregistered fragment %s. No action taken' % (phrase['name'], err))
+            return None
+        except ValueError as err:
+            logging.error('Could not render phrase [%s]: %s' % (phrase['name'], err))
+            return None
+
+        logging.debug('Rendered phrase %s (%d bytes)' % (phrase['name'], len(pcm)))
+        return self._render_cache.put(key, pcm)
+
+    def consumeMessages(self, heartbeat=None):
+        """Consumes messages until an 'end_thread' message is received
+
+        Sleeps for idle_sleep after a pass which found no commands, rather than spinning
+
+        Keyword Arguments:
+            heartbeat {Heartbeat} -- Beaten on every pass, so a supervisor can tell we're alive (default: {None})
+        """
         while True:
-            for q in self._queue_list:
-                if not q.empty():
-                    soundInfo = q.get(block=False, timeout=0.01)
-                    if not soundInfo:
-                        continue
-
-                    logging.debug("audioQueue.get pulled [%s]" % str(soundInfo))
-                    if dict is not type(soundInfo):
-                        logging.warn("audioQueue.get pulled an object that was not a dict")
-                        logging.warn("type is %s" % type(soundInfo))
-                        continue
-
-                    try:
-                        if soundInfo['action'] == 'play':
-                            self.playSound(soundInfo['name'], soundInfo['loop'])
-                        elif soundInfo['action'] == 'stop':
-                            self.stopSound(soundInfo['name'])
-                        elif soundInfo['action'] == 'end_thread':
-                            logging.debug("Received end_thread message.")
-                            return  # special message to end the thread
-                    except KeyError:
-                        logging.error("KeyError - soundInfo %s improperly structured" %
-                                    soundInfo)
+            handled = self.commandsHandled
+            if not self.processPendingMessages():
+                return
+            if heartbeat:
+                heartbeat.beat()
+            if self.commandsHandled == handled:
+                time.sleep(self._idle_sleep)
+
+    def processPendingMessages(self):
+        """Makes a single non-blocking pass over the message queues
+
+        consumeMessages just calls this in a loop.  It is public so that benchmarks can drive
+        the controller step by step (e.g. against a NullBackend running in virtual time)
+
+        Returns:
+            {bool} -- False once an 'end_thread' message has been received, True else
+        """
+        self._sequencer.advance()
+        self._backend.service()
+        for q in self._queue_list:
+            if hasattr(q, 'get_many'):
+                # Everything which is ready is applied in one go
+                if not self._handleBatch(q.get_many()):
+                    return False
+            elif not q.empty():
+                soundInfo = q.get(block=False, timeout=0.01)
+                if not soundInfo:
+                    continue
+
+                if not self._handleCommand(soundInfo):
+                    return False  # special message to end the thread
+        return True
+
+    @staticmethod
+    def resolveBatch(commands):
+        """Drops the plays of a batch which would be stopped again within the same batch
 
+        A play followed by a stop of the same sound cancels out:  The play is dropped, and
+        the stop is kept (for any instance which was already playing).  Everything else is
+        kept as is, repeated plays included, so a batch plays the same sounds however the
+        commands happened to be split into batches.  Nothing after an end_thread is kept
 
+        Arguments:
+            commands {list} -- AudioCommands, in order
+
+        Returns:
+            {list} -- The commands which still need to be applied, in order
+        """
+        end = len(commands)
+        last_stop = {}
+        for i, command in enumerate(commands):
+            if command.action == 'end_thread':
+                end = i + 1
+                break
+            if command.action == 'stop':
+                last_stop[command.name] = i
+
+        resolved = []
+        for i, command in enumerate(commands[:end]):
+            if command.action == 'play' and i < last_stop.get(command.name, -1):
+                continue
+            resolved.append(command)
+        return resolved
+
+    def _handleBatch(self, commands):
+        """Applies a batch of commands pulled off a queue with get_many
+
+        Arguments:
+            commands {list} -- Audio commands, in order
+
+        Returns:
+            {bool} -- False if the batch contained an 'end_thread' message, True else
+        """
+        # Anything else (older dict commands) is left to _handleCommand to convert or reject.
+        # get_many keeps the order the commands were put in across its lanes, so a play is only
+        # ever followed by a stop it really came before
+        if len(commands) > 1 and all(isinstance(command, AudioCommand) for command in commands):
+            commands = AudioController.resolveBatch(commands)
+        for command in commands:
+            if not self._handleCommand(command):
+                return False
+        return True
+
+    def _handleCommand(self, soundInfo):
+        """Applies a single command pulled off of one of the message queues
+
+        Arguments:
+            soundInfo {AudioCommand} -- Audio command (a dict is converted, for older callers)
+
+        Returns:
+            {bool} -- False if the command was an 'end_thread' message, True else
+        """
+        self.commandsHandled += 1
+        logging.debug("audioQueue.get pulled [%s]" % (soundInfo,))
+        if type(soundInfo) is dict:
+            try:
+                soundInfo = AudioCommand.fromDict(soundInfo)
+            except ValueError as err:
+                logging.error("soundInfo improperly structured: %s" % err)
+                return True
+        elif not isinstance(soundInfo, AudioCommand):
+            logging.warn("audioQueue.get pulled an object that was not an AudioCommand")
+            logging.warn("type is %s" % type(soundInfo))
+            return True
+
+        trace = soundInfo.trace
+        if trace is not None:
+            trace.stamp('queue_to_audio')
+
+        if soundInfo.action == 'play':
+            self.playSound(soundInfo.name, soundInfo.loop)
+        elif soundInfo.action == 'stop':
+            self.stopSound(soundInfo.name)
+        elif soundInfo.action == 'end_thread':
+            logging.debug("Received end_thread message.")
+            logging.info("Cue jitter: %s" % self._sequencer.getJitterStats())
+            if self._trace_writer:
+                self._trace_writer.close()
+            return False
+
+        if trace is not None:
+            trace.stamp('mixer')
+            if self._trace_writer:
+                self._trace_writer.write(trace)
+        return True
+
+    def playCue(self, cue_name, sound_list=None):
+        """ Schedule the sounds of a cue, each at its offset from now
+
+        Keyword arguments:
+        cue_name -- the string used to refer to the cue (and to stop it)
+        sound_list -- list of {'name': <str>, 'offset': <float>} dicts.  If None, the
+                      cue must have been registered through 'cue_list' in the config
+        """
+        if sound_list is None:
+            if cue_name not in self._cue_registry:
+                logging.error('Could not found [%s] in cue registry. No action taken' % cue_name)
+                return
+            sound_list = self._cue_registry[cue_name]
+
+        logging.debug("Playing cue registered as %s" % cue_name)
+        self._sequencer.schedule(cue_name, sound_list)
+
+    def stopCue(self, cue_name):
+        """ Cancel the pending sounds of a cue, and stop the ones it already started
+
+        Keyword arguments:
+        cue_name -- the string used to refer to the cue
+        """
+        for registry_name in self._sequencer.cancel(cue_name):
+            self.stopSound(registry_name)
 
     def playSound(self, registry_name, loop=False):
-        """ Play a sound previously registered (via the pygame linkage)
+        """ Play a sound previously registered (via the audio backend)
 
         Keyword arguments:
         registry_name -- the string used to refer to a registered audio clip
         loop -- Whether or not to loop the audio clip (default False)
         """
+        if registry_name in self._cue_registry:
+            self.playCue(registry_name)
+            return
+        self.__playRegistered(registry_name, loop)
+
+    def __playRegistered(self, registry_name, loop=False):
         num_times = 0
         if loop:
             num_times = -1
 
 
         if registry_name not in self._audio_registry:
-            logging.error('Could not found [%s] in sound registry. No action taken' % registry_name)
+            phrase = self._phrase_registry.get(registry_name)
+            if phrase is None:
+                logging.error('Could not found [%s] in sound registry. No action taken' % registry_name)
+                return
+            handle = self.__phraseHandle(phrase)
+            if handle is not None:
+                logging.debug("Playing phrase %s" % registry_name)
+                self._backend.play(handle, loops=num_times)
             return
 
         logging.debug("Playing sound registered as %s" % registry_name)
-        self._audio_registry[registry_name]['sound'].play(loops=num_times)
+        self._backend.play(self._audio_registry[registry_name]['sound'], loops=num_times)
 
     def stopSound(self, registry_name):
-        """ Stop a sound previously registered (via the pygame linkage)
+        """ Stop a sound previously registered (via the audio backend)
 
         Keyword arguments:
         registry_name -- the string used to refer to a registered audio clip
         """
+        if registry_name in self._cue_registry:
+            self.stopCue(registry_name)
+            return
+
         if registry_name not in self._audio_registry:
-            logging.error('Could not found [%s] in sound registry. No action taken' % registry_name)
+            phrase = self._phrase_registry.get(registry_name)
+            if phrase is None:
+                logging.error('Could not found [%s] in sound registry. No action taken' % registry_name)
+                return
+            # A phrase which isn't cached any more isn't playing either
+            handle = self._render_cache.peek(AudioController.__phraseKey(phrase))
+            if handle is not None:
+                self._backend.stop(handle)
             return
-        self._audio_registry[registry_name]['sound'].stop()
+        self._backend.stop(self._audio_registry[registry_name]['sound'])
+
+    def isPlaying(self, registry_name):
+        """ Returns True if the registered sound is currently playing
+
+        Keyword arguments:
+        registry_name -- the string used to refer to a registered audio clip
+        """
+        if registry_name not in self._audio_registry:
+            phrase = self._phrase_registry.get(registry_name)
+            if phrase is None:
+                return False
+            handle = self._render_cache.peek(AudioController.__phraseKey(phrase))
+            return handle is not None and self._backend.busy(handle)
+        return self._backend.busy(self._audio_registry[registry_name]['sound'])
 
 
 if __name__ == '__main__':
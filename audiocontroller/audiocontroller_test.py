@@ -2,12 +2,13 @@ from multiprocessing import Process, Queue
 
 from audiocontroller import audio_controller_worker
 from audiocontroller import AudioController as ac
+from pipeline.messages import AudioCommand, END_THREAD
 import time
 
 
 config = [{'name': 'button', 'sound': 'button.wav', 'loopable': True}]
-cmdStart = {'name': 'button', 'action': 'play', 'loop': True}
-cmdStop = {'name': 'button', 'action': 'stop', 'loop': True}
+cmdStart = AudioCommand('play', 'button', loop=True)
+cmdStop = AudioCommand('stop', 'button', loop=True)
 
 q = Queue()
 audio_process = Process( target=audio_controller_worker, args=(config, [q],))
@@ -21,5 +22,4 @@ q.put(cmdStop)
 time.sleep(2)
 
 
-end_thread = {'action': 'end_thread'}
-q.put(end_thread)
+q.put(END_THREAD)
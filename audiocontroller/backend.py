@@ -0,0 +1,353 @@
+"""Audio backends used by the AudioController
+
+The AudioController only ever talks to a backend through load/play/stop/busy/release, so
+the same controller logic can drive pygame on the panel, or a NullBackend on a headless
+machine (for benchmarks and throughput tests, where time can run faster than real time).
+"""
+
+import logging
+import time
+import wave
+
+from pcmcache import PcmCache
+
+try:
+    import pygame
+    from streaming import StreamingSound
+except ImportError:
+    pygame = None
+
+
+def createBackend(config):
+    """Builds the backend named by config['backend']
+
+    Arguments:
+        config {dict} -- AudioController config.  'backend' is either 'pygame' (the default),
+                         'null', 'recording', or an already constructed AudioBackend
+
+    Returns:
+        {AudioBackend} -- The backend to use
+    """
+    backend = config.get('backend', 'pygame')
+    if isinstance(backend, AudioBackend):
+        return backend
+
+    if backend == 'pygame':
+        return PygameBackend(mixer_buffer=config.get('mixer_buffer'),
+                             pcm_cache_path=config.get('pcm_cache_path'))
+    if backend == 'null':
+        return NullBackend()
+    if backend == 'recording':
+        return RecordingBackend()
+
+    raise ValueError('Unknown audio backend [%s]' % backend)
+
+
+class AudioBackend(object):
+    """Interface for the things the AudioController needs from an audio library
+
+    Handles returned by load() are opaque to the AudioController
+    """
+
+    def load(self, file_path, stream=False):
+        """Loads a sound file
+
+        Arguments:
+            file_path {str} -- Path to the wav file
+
+        Keyword Arguments:
+            stream {bool|str} -- Stream the file instead of decoding it; 'mmap' streams through a memory map (default: {False})
+
+        Returns:
+            {object} -- Handle to pass to the other methods
+        """
+        raise NotImplementedError
+
+    def play(self, handle, loops=0):
+        """Plays the sound.  loops=-1 repeats it until stopped"""
+        raise NotImplementedError
+
+    def stop(self, handle):
+        """Stops every playing instance of the sound"""
+        raise NotImplementedError
+
+    def busy(self, handle):
+        """Returns True if the sound is currently playing"""
+        raise NotImplementedError
+
+    def release(self, handle):
+        """Frees anything held for the sound.  The handle can't be used afterwards"""
+        raise NotImplementedError
+
+    def service(self):
+        """Called on every pass of the consume loop, for backends that need to do periodic work"""
+        pass
+
+    def now(self):
+        """Returns the time (in seconds) as seen by this backend"""
+        return time.time()
+
+    def getBufferSeconds(self):
+        """Returns the length of one mixer buffer, in seconds"""
+        raise NotImplementedError
+
+    def getPcm(self, handle):
+        """Returns the decoded samples of a loaded sound, in the format given by getPcmFormat
+
+        Raises:
+            ValueError -- If the sound has no decoded samples (e.g. it is streamed)
+        """
+        raise NotImplementedError
+
+    def loadPcm(self, pcm):
+        """Makes a sound from decoded samples, in the format given by getPcmFormat
+
+        Returns:
+            {object} -- Handle to pass to the other methods
+        """
+        raise NotImplementedError
+
+    def getPcmFormat(self):
+        """Returns the (frequency, sample width in bytes, channels) of the samples in getPcm/loadPcm"""
+        raise NotImplementedError
+
+
+class PygameBackend(AudioBackend):
+    """Plays sounds through pygame.mixer"""
+
+    # pygame 1.9 mixer default, used if the buffer size was not configured
+    DEFAULT_MIXER_BUFFER = 4096
+
+    def __init__(self, mixer_buffer=None, pcm_cache_path=None):
+        """Initializes pygame and the mixer
+
+        Keyword Arguments:
+            mixer_buffer {int} -- Mixer buffer size in samples.  pygame's default is used if None (default: {None})
+            pcm_cache_path {str} -- Directory where decoded PCM is cached, to skip decoding on a warm start (see pcmcache.py) (default: {None})
+        """
+        if pygame is None:
+            raise ImportError('pygame is required for the pygame audio backend')
+
+        pygame.init()
+        if mixer_buffer:
+            pygame.mixer.init(buffer=mixer_buffer)
+        else:
+            pygame.mixer.init()
+            mixer_buffer = PygameBackend.DEFAULT_MIXER_BUFFER
+
+        self._buffer_seconds = float(mixer_buffer) / pygame.mixer.get_init()[0]
+
+        # Streamed sounds need to be serviced from the consume loop to keep their buffers full
+        self._streaming_sounds = []
+
+        self._pcm_cache = None
+        if pcm_cache_path:
+            self._pcm_cache = PcmCache(pcm_cache_path, pygame.mixer.get_init())
+            self._pcm_cache.prune()
+
+    @staticmethod
+    def _decode(file_path):
+        return pygame.mixer.Sound(file_path).get_raw()
+
+    def load(self, file_path, stream=False):
+        if stream:
+            sound = StreamingSound(file_path, memory_map=(stream == 'mmap'))
+            self._streaming_sounds.append(sound)
+            return sound
+        if self._pcm_cache:
+            # A warm start skips decoding altogether.  pygame copies the samples, so the
+            # mapping isn't needed once the Sound is built
+            pcm = self._pcm_cache.load(file_path, PygameBackend._decode)
+            try:
+                return pygame.mixer.Sound(buffer=pcm)
+            finally:
+                pcm.close()
+        return pygame.mixer.Sound(file_path)
+
+    def play(self, handle, loops=0):
+        handle.play(loops=loops)
+
+    def stop(self, handle):
+        handle.stop()
+
+    def busy(self, handle):
+        if isinstance(handle, StreamingSound):
+            return handle.isPlaying()
+        return handle.get_num_channels() > 0
+
+    def release(self, handle):
+        handle.stop()
+        if isinstance(handle, StreamingSound):
+            self._streaming_sounds.remove(handle)
+            handle.release()
+
+    def service(self):
+        for sound in self._streaming_sounds:
+            sound.service()
+
+    def getBufferSeconds(self):
+        return self._buffer_seconds
+
+    def getPcm(self, handle):
+        if isinstance(handle, StreamingSound):
+            raise ValueError('Streamed sounds have no decoded samples')
+        return handle.get_raw()
+
+    def loadPcm(self, pcm):
+        return pygame.mixer.Sound(buffer=pcm)
+
+    def getPcmFormat(self):
+        frequency, size, channels = pygame.mixer.get_init()
+        return (frequency, abs(size) // 8, channels)
+
+
+class VirtualClock(object):
+    """Clock for the NullBackend
+
+    With no time_scale, time only moves when advance() is called.  With a time_scale,
+    it follows the wall clock sped up by that factor.
+    """
+
+    def __init__(self, time_scale=None):
+        self._time_scale = time_scale
+        self._wall_start = time.time()
+        self._offset = 0.0
+
+    def now(self):
+        if self._time_scale is None:
+            return self._offset
+        return (time.time() - self._wall_start) * self._time_scale + self._offset
+
+    def advance(self, seconds):
+        self._offset += seconds
+
+
+class _NullSound(object):
+    __slots__ = ('file_path', 'duration')
+
+    def __init__(self, file_path, duration):
+        self.file_path = file_path
+        self.duration = duration
+
+
+class NullBackend(AudioBackend):
+    """Makes no sound, but simulates sound durations and channel occupancy in virtual time
+
+    Like pygame, a play() with every channel busy is dropped.
+
+    example usage:
+
+    clock = VirtualClock()
+    backend = NullBackend(clock=clock)
+    ac = AudioController({'audio_file_list': [...], 'backend': backend}, [q])
+    ac.processPendingMessages()
+    clock.advance(0.5)
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, num_channels=8, clock=None, frequency=22050, buffer_size=4096):
+        """Initialize the NullBackend
+
+        Keyword Arguments:
+            num_channels {int} -- Number of sounds which can play at once (default: {8})
+            clock {VirtualClock} -- Source of virtual time.  A manually advanced clock is made if None (default: {None})
+            frequency {int} -- Simulated mixer frequency (default: {22050})
+            buffer_size {int} -- Simulated mixer buffer size in samples (default: {4096})
+        """
+        self.clock = clock if clock is not None else VirtualClock()
+        self._frequency = frequency
+        self._buffer_seconds = float(buffer_size) / frequency
+
+        # Each channel is [handle, end_time], or None if it is free
+        self._channels = [None] * num_channels
+
+        self.playCount = 0
+        self.dropCount = 0
+        self.maxChannelsInUse = 0
+
+    def _durationOf(self, file_path):
+        try:
+            wav = wave.open(file_path, 'rb')
+            try:
+                return float(wav.getnframes()) / wav.getframerate()
+            finally:
+                wav.close()
+        except (IOError, wave.Error) as err:
+            self._logger.warning('Could not read duration of %s: %s' % (file_path, err))
+            return 0.0
+
+    def _expireChannels(self):
+        now = self.clock.now()
+        in_use = 0
+        for i, channel in enumerate(self._channels):
+            if channel is not None and channel[1] <= now:
+                self._channels[i] = None
+            elif channel is not None:
+                in_use += 1
+        return in_use
+
+    def load(self, file_path, stream=False):
+        return _NullSound(file_path, self._durationOf(file_path))
+
+    def play(self, handle, loops=0):
+        in_use = self._expireChannels()
+        if in_use == len(self._channels):
+            self.dropCount += 1
+            return
+
+        if loops < 0:
+            end_time = float('inf')
+        else:
+            end_time = self.clock.now() + handle.duration * (loops + 1)
+
+        self._channels[self._channels.index(None)] = [handle, end_time]
+        self.playCount += 1
+        self.maxChannelsInUse = max(self.maxChannelsInUse, in_use + 1)
+
+    def stop(self, handle):
+        for i, channel in enumerate(self._channels):
+            if channel is not None and channel[0] is handle:
+                self._channels[i] = None
+
+    def busy(self, handle):
+        self._expireChannels()
+        for channel in self._channels:
+            if channel is not None and channel[0] is handle:
+                return True
+        return False
+
+    def release(self, handle):
+        self.stop(handle)
+
+    def now(self):
+        return self.clock.now()
+
+    def getBufferSeconds(self):
+        return self._buffer_seconds
+
+    def getPcm(self, handle):
+        # Silence of the right length:  Enough for rendering and cache accounting
+        return b'\x00' * (int(handle.duration * self._frequency) * 2)
+
+    def loadPcm(self, pcm):
+        return _NullSound('<rendered>', float(len(pcm)) / (self._frequency * 2))
+
+    def getPcmFormat(self):
+        return (self._frequency, 2, 1)
+
+
+class RecordingBackend(NullBackend):
+    """NullBackend which also records every play and stop, as (time, action, file_path) tuples"""
+
+    def __init__(self, *args, **kwargs):
+        NullBackend.__init__(self, *args, **kwargs)
+        self.calls = []
+
+    def play(self, handle, loops=0):
+        self.calls.append((self.now(), 'play', handle.file_path))
+        NullBackend.play(self, handle, loops)
+
+    def stop(self, handle):
+        self.calls.append((self.now(), 'stop', handle.file_path))
+        NullBackend.stop(self, handle)
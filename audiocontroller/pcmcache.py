@@ -0,0 +1,178 @@
+"""On-disk cache of decoded PCM, so a warm start skips decoding
+
+Decoding every wav file at startup is the slow part of building an AudioController.  The
+decoded samples are written once to a cache file, keyed by the sound's path, its mtime
+and the mixer format, and from then on every process reads that file instead of decoding.
+
+This is a decode cache only:  pygame copies the samples into memory of its own when it
+builds a Sound from a buffer, so each process still holds a private copy of every sound.
+The cache file is mapped just long enough for that copy to be made.
+
+A cache file is replaced (and the old one deleted) when its sound file changes.  Files
+which no process has used for a while, such as those of sounds which were removed, are
+deleted by prune().
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import time
+
+
+# Age (in seconds) after which prune() deletes unused cache files, and leftover temp files
+MAX_UNUSED_AGE = 30 * 24 * 3600
+MAX_TEMP_AGE = 3600
+
+
+class PcmCache(object):
+    """Reads decoded PCM for sound files from a cache directory
+
+    example usage:
+
+    cache = PcmCache('/var/cache/oliver', pygame.mixer.get_init())
+    cache.prune()
+    pcm = cache.load('audio_files/startup_sweep.wav', decode)
+    sound = pygame.mixer.Sound(buffer=pcm)  # pygame copies the samples
+    pcm.close()
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, cache_path, mixer_format):
+        """Initialize the PcmCache
+
+        Arguments:
+            cache_path {str} -- Directory holding the cache files.  Created if it doesn't exist
+            mixer_format {tuple} -- Mixer format the PCM is decoded to, e.g. pygame.mixer.get_init()
+        """
+        self._cache_path = cache_path
+        self._mixer_format = tuple(mixer_format)
+
+        if not os.path.isdir(cache_path):
+            os.makedirs(cache_path)
+
+        self.hits = 0
+        self.misses = 0
+
+    def _prefixFor(self, file_path):
+        """Every version of a sound's cache file starts with this, whatever the sound's mtime"""
+        key = '%s|%r' % (os.path.abspath(file_path), self._mixer_format)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _cacheFileFor(self, file_path):
+        mtime = repr(os.stat(file_path).st_mtime)
+        version = hashlib.sha1(mtime.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self._cache_path, '%s-%s.pcm' % (self._prefixFor(file_path), version))
+
+    @staticmethod
+    def _map(cache_file):
+        with open(cache_file, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, file_path):
+        """Returns the cached PCM for a sound file as a read-only mmap, or None if it isn't cached
+
+        The caller closes the mmap once it has copied the samples
+
+        Arguments:
+            file_path {str} -- Path to the (source) wav file
+        """
+        cache_file = self._cacheFileFor(file_path)
+        if not os.path.exists(cache_file):
+            return None
+        try:
+            # Marks the file as used, for prune()
+            os.utime(cache_file, None)
+        except OSError:
+            pass
+        return PcmCache._map(cache_file)
+
+    def put(self, file_path, pcm):
+        """Stores the decoded PCM of a sound file, and returns it mapped from the cache
+
+        The file is written under a temporary name and renamed into place, so a process
+        starting at the same time never maps a partly written file.  Cache files of earlier
+        versions of the sound are deleted
+
+        Arguments:
+            file_path {str} -- Path to the (source) wav file
+            pcm {bytes} -- Decoded samples, in the mixer format
+        """
+        cache_file = self._cacheFileFor(file_path)
+        fd, temp_path = tempfile.mkstemp(dir=self._cache_path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pcm)
+            os.rename(temp_path, cache_file)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+        prefix = self._prefixFor(file_path)
+        for name in os.listdir(self._cache_path):
+            path = os.path.join(self._cache_path, name)
+            if name.startswith(prefix) and name.endswith('.pcm') and path != cache_file:
+                self._remove(path)
+        return PcmCache._map(cache_file)
+
+    def load(self, file_path, decode):
+        """Returns the PCM for a sound file, decoding (and caching) it only if it isn't cached yet
+
+        Arguments:
+            file_path {str} -- Path to the wav file
+            decode {function} -- Called as decode(file_path) on a miss.  Returns the samples in the mixer format
+
+        Returns:
+            {mmap.mmap} -- Read-only mapping of the decoded samples.  The caller closes it
+        """
+        pcm = self.get(file_path)
+        if pcm is not None:
+            self.hits += 1
+            return pcm
+
+        self.misses += 1
+        self._logger.info('Decoding %s into the PCM cache' % file_path)
+        return self.put(file_path, decode(file_path))
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+            return True
+        except OSError as err:
+            # Another process may have removed it first
+            self._logger.debug('Could not remove %s from the PCM cache: %s' % (path, err))
+            return False
+
+    def prune(self, max_unused_age=MAX_UNUSED_AGE, max_temp_age=MAX_TEMP_AGE):
+        """Deletes cache files no process has used within max_unused_age, and temp files left
+        behind by writers which died
+
+        Keyword Arguments:
+            max_unused_age {float} -- Seconds since a cache file was last used (default: {30 days})
+            max_temp_age {float} -- Seconds since a temp file was last written (default: {1 hour})
+
+        Returns:
+            {int} -- Number of files deleted
+        """
+        now = time.time()
+        removed = 0
+        for name in os.listdir(self._cache_path):
+            if name.endswith('.pcm'):
+                max_age = max_unused_age
+            elif name.endswith('.tmp'):
+                max_age = max_temp_age
+            else:
+                continue
+            path = os.path.join(self._cache_path, name)
+            try:
+                age = now - os.stat(path).st_mtime
+            except OSError:
+                continue
+            if age > max_age and self._remove(path):
+                removed += 1
+
+        if removed:
+            self._logger.info('Pruned %d files from the PCM cache' % removed)
+        return removed
@@ -0,0 +1,124 @@
+"""Composite announcements, rendered from registered fragments
+
+A phrase such as ['scan_completed', 'radar_engaged'] is rendered once into a single sound,
+by concatenating the fragments' PCM (with optional silence between them) or mixing them
+on top of each other.  Rendered sounds are kept in a cache bounded by their size in bytes,
+so after the first play a phrase starts like any other sound, with no gaps between the
+fragments for the scheduler to get wrong.
+"""
+
+import audioop
+import collections
+import logging
+
+
+CONCAT = 'concat'
+OVERLAY = 'overlay'
+
+
+def renderPhrase(pcm_list, mode, pcm_format, gap=0.0):
+    """Renders fragments into the PCM of a single sound
+
+    Arguments:
+        pcm_list {list} -- PCM of each fragment, all in the same format
+        mode {str} -- CONCAT (one after the other) or OVERLAY (all at once, mixed)
+        pcm_format {tuple} -- (frequency, sample width in bytes, channels) of the PCM
+
+    Keyword Arguments:
+        gap {float} -- Seconds of silence between fragments, for CONCAT (default: {0.0})
+
+    Returns:
+        {bytes} -- The rendered PCM
+    """
+    frequency, width, channels = pcm_format
+    if mode == CONCAT:
+        silence = b'\x00' * (int(gap * frequency) * width * channels)
+        return silence.join(bytes(pcm) for pcm in pcm_list)
+
+    if mode == OVERLAY:
+        length = max(len(pcm) for pcm in pcm_list)
+        mixed = b'\x00' * length
+        for pcm in pcm_list:
+            pcm = bytes(pcm)
+            # audioop clips rather than wraps, so loud fragments saturate instead of crackling
+            mixed = audioop.add(mixed, pcm + b'\x00' * (length - len(pcm)), width)
+        return mixed
+
+    raise ValueError('Unknown phrase mode [%s]' % mode)
+
+
+class RenderCache(object):
+    """Least recently used cache of rendered phrases, bounded by the bytes of PCM they hold
+
+    Sounds which are still playing are never evicted (freeing them would cut them off), so
+    the cache can go over its budget until they finish
+
+    example usage:
+
+    cache = RenderCache(backend, max_bytes=8 * 1024 * 1024)
+    handle = cache.get(key)
+    if handle is None:
+        handle = cache.put(key, pcm)
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, backend, max_bytes=8 * 1024 * 1024):
+        """Initialize the RenderCache
+
+        Arguments:
+            backend {AudioBackend} -- Backend which loads the rendered PCM as sounds
+
+        Keyword Arguments:
+            max_bytes {int} -- Budget for the rendered PCM (default: {8 MB})
+        """
+        self._backend = backend
+        self._max_bytes = max_bytes
+
+        # key -> (handle, size in bytes), least recently used first
+        self._entries = collections.OrderedDict()
+        self.sizeBytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the handle of a rendered phrase, or None if it isn't cached"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def peek(self, key):
+        """Returns the handle of a rendered phrase, or None, without counting it as a use"""
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, pcm):
+        """Loads rendered PCM as a sound and caches it, evicting the least recently used phrases
+
+        Returns:
+            {object} -- Backend handle of the sound
+        """
+        handle = self._backend.loadPcm(pcm)
+        self._entries[key] = (handle, len(pcm))
+        self.sizeBytes += len(pcm)
+        self._evict()
+        return handle
+
+    def _evict(self):
+        for key in list(self._entries.keys())[:-1]:
+            if self.sizeBytes <= self._max_bytes:
+                return
+            handle, size = self._entries[key]
+            if self._backend.busy(handle):
+                continue
+            del self._entries[key]
+            self._backend.release(handle)
+            self.sizeBytes -= size
+            self.evictions += 1
+            self._logger.debug('Evicted rendered phrase %s (%d bytes)' % (key, size))
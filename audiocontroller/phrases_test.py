@@ -0,0 +1,91 @@
+"""Checks phrase rendering (concat and overlay), RenderCache eviction, and that only
+registered phrases are played.  Runs headless, against the NullBackend
+
+    PYTHONPATH=. python audiocontroller/phrases_test.py
+"""
+
+import logging
+import struct
+
+from audiocontroller import AudioController
+from backend import NullBackend
+from phrases import CONCAT, OVERLAY, RenderCache, renderPhrase
+
+
+logging.basicConfig(format='%(filename)s.%(lineno)d:%(levelname)s:%(message)s',
+                    level=logging.WARNING)
+
+# 16 bit mono, as the NullBackend reports it
+PCM_FORMAT = (1000, 2, 1)
+
+
+def samples(*values):
+    return struct.pack('<%dh' % len(values), *values)
+
+
+def test_concat():
+    pcm = renderPhrase([samples(1, 2), samples(3)], CONCAT, PCM_FORMAT, gap=0.002)
+    assert pcm == samples(1, 2, 0, 0, 3), repr(pcm)
+
+
+def test_overlay():
+    # The shorter fragment is padded with silence, and the mix clips rather than wraps
+    pcm = renderPhrase([samples(100, 30000, 5), samples(-50, 30000)], OVERLAY, PCM_FORMAT)
+    assert pcm == samples(50, 32767, 5), repr(pcm)
+
+
+def test_unknown_mode():
+    try:
+        renderPhrase([samples(1)], 'reverse', PCM_FORMAT)
+    except ValueError:
+        return
+    assert False, 'renderPhrase accepted an unknown mode'
+
+
+def test_eviction():
+    backend = NullBackend()
+    cache = RenderCache(backend, max_bytes=3000)
+    handles = dict((key, cache.put(key, b'\x00' * 1000)) for key in ('a', 'b', 'c'))
+    assert cache.evictions == 0 and cache.sizeBytes == 3000
+
+    # 'a' was used most recently, so 'b' is the one to go
+    cache.get('a')
+    cache.put('d', b'\x00' * 1000)
+    assert cache.peek('b') is None and cache.peek('a') is not None
+    assert cache.evictions == 1 and cache.sizeBytes == 3000
+
+    # A phrase which is still playing is skipped, even if it is the least recently used
+    backend.play(handles['c'])
+    cache.put('e', b'\x00' * 1000)
+    assert cache.peek('c') is not None and cache.peek('a') is None
+    assert cache.evictions == 2 and cache.sizeBytes == 3000
+
+
+def test_registered_phrases_only():
+    backend = NullBackend()
+    config = {
+        'audio_file_list': [
+            {'name': 'blip_low',    'loopable': False},
+            {'name': 'blip_medium', 'loopable': False}
+            ],
+        'phrase_list': [
+            {'name': 'blip_low_medium', 'fragments': ['blip_low', 'blip_medium'], 'gap': 0.1}
+            ],
+        'default_audio_path': 'audio_files',
+        'backend': backend
+    }
+    ac = AudioController(config, [])
+
+    ac.playSound('blip_low_medium')
+    assert backend.playCount == 1 and ac.isPlaying('blip_low_medium')
+
+    # Names made of fragments aren't phrases unless they were registered
+    rendered_bytes = ac._render_cache.sizeBytes
+    ac.playSound('blip_low+blip_medium')
+    assert backend.playCount == 1 and ac._render_cache.sizeBytes == rendered_bytes
+
+
+if __name__ == '__main__':
+    for test in (test_concat, test_overlay, test_unknown_mode, test_eviction, test_registered_phrases_only):
+        test()
+        print('%s ok' % test.__name__)
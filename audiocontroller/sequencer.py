@@ -0,0 +1,193 @@
+"""Schedules multi-sound cues (e.g. a power-up sequence) against the audiocontroller
+
+A cue is a list of sounds with offsets (in seconds) from the moment the cue is started.
+The pending sounds are kept on a timer wheel, which is advanced from the
+AudioController.consumeMessages loop, so no extra threads or sleeps are needed.
+"""
+
+import logging
+import time
+
+
+class _CueEntry(object):
+    """A single pending sound on the timer wheel"""
+
+    __slots__ = ('cue_name', 'sound_name', 'loop', 'fire_tick', 'fire_time', 'cancelled')
+
+    def __init__(self, cue_name, sound_name, loop, fire_tick, fire_time):
+        self.cue_name = cue_name
+        self.sound_name = sound_name
+        self.loop = loop
+        self.fire_tick = fire_tick
+        self.fire_time = fire_time
+        self.cancelled = False
+
+
+class Sequencer(object):
+    """Timer wheel of pending cue sounds
+
+    The wheel has `wheel_size` slots, each `tick_seconds` wide.  Entries further out than
+    one revolution stay in their slot until the wheel comes around to their tick.
+
+    example usage:
+
+    seq = Sequencer(play_callback=ac.playSound, stop_callback=ac.stopSound)
+    seq.schedule('power_up', [{'name': 'startup_sweep', 'offset': 0.0},
+                              {'name': 'all_systems_nominal', 'offset': 4.5}])
+    while True:
+        seq.advance()
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, play_callback, tick_seconds=0.01, wheel_size=512,
+                 jitter_budget=None, clock=time.time, stop_callback=None):
+        """Initialize the Sequencer
+
+        Arguments:
+            play_callback {function} -- Called as play_callback(sound_name, loop) when an entry fires
+
+        Keyword Arguments:
+            tick_seconds {float} -- Resolution of the timer wheel (default: {0.01})
+            wheel_size {int} -- Number of slots on the wheel (default: {512})
+            jitter_budget {float} -- Jitter (seconds) above which a fire is counted as late (default: {None})
+            clock {function} -- Returns the current time in seconds (default: {time.time})
+            stop_callback {function} -- Called as stop_callback(sound_name) for each sound a replaced cue had started (default: {None})
+        """
+        self._play_callback = play_callback
+        self._stop_callback = stop_callback
+        self._tick_seconds = float(tick_seconds)
+        self._wheel_size = wheel_size
+        self._jitter_budget = jitter_budget
+        self._clock = clock
+
+        self._wheel = [[] for _ in range(wheel_size)]
+        self._start_time = self._clock()
+        self._current_tick = 0
+
+        # cue name -> list of _CueEntry objects which have not fired yet
+        self._pending = {}
+
+        # cue name -> list of sound names which have already been played for that cue
+        self._started = {}
+
+        self._jitter_count = 0
+        self._jitter_total = 0.0
+        self._jitter_max = 0.0
+        self._jitter_late = 0
+
+    def _tickForTime(self, t):
+        return int((t - self._start_time) / self._tick_seconds)
+
+    def isPending(self, cue_name):
+        """Returns True if the named cue still has sounds waiting to be played"""
+        return cue_name in self._pending
+
+    def schedule(self, cue_name, sound_list):
+        """Schedule each sound in sound_list relative to now
+
+        Scheduling a cue which was scheduled before replaces it:  Its pending sounds are
+        cancelled, and the ones it already started are stopped (through stop_callback)
+
+        Arguments:
+            cue_name {str} -- Name used to cancel the cue later on
+            sound_list {list} -- List of {'name': <str>, 'offset': <float>, 'loop': <bool>} dicts ('loop' is optional)
+        """
+        for sound_name in self.cancel(cue_name):
+            if self._stop_callback is not None:
+                self._stop_callback(sound_name)
+
+        now = self._clock()
+        entries = []
+        self._started[cue_name] = []
+        for item in sound_list:
+            fire_time = now + float(item.get('offset', 0.0))
+            entry = _CueEntry(cue_name, item['name'], item.get('loop', False),
+                              self._tickForTime(fire_time), fire_time)
+            self._wheel[entry.fire_tick % self._wheel_size].append(entry)
+            entries.append(entry)
+
+        self._pending[cue_name] = entries
+        self._logger.debug('Scheduled cue [%s] with %d sounds' % (cue_name, len(entries)))
+
+        # Anything with a zero offset should start right away, not on the next pass
+        self.advance()
+
+    def cancel(self, cue_name):
+        """Cancels any sounds in the cue which have not yet been played
+
+        Arguments:
+            cue_name {str} -- Name of the cue passed to schedule
+
+        Returns:
+            {list} -- Sound names of the cue which had already been started
+        """
+        for entry in self._pending.pop(cue_name, []):
+            entry.cancelled = True
+        return self._started.pop(cue_name, [])
+
+    def advance(self):
+        """Fires every entry whose time has come.  Call this from the consume loop
+        """
+        target_tick = self._tickForTime(self._clock())
+        if not self._pending:
+            # Nothing to fire, so don't walk every empty slot since the last pass
+            self._current_tick = max(self._current_tick, target_tick)
+            return
+
+        while self._current_tick <= target_tick:
+            slot = self._wheel[self._current_tick % self._wheel_size]
+            if slot:
+                self._fireSlot(slot)
+            if self._current_tick == target_tick:
+                break
+            self._current_tick += 1
+
+    def _fireSlot(self, slot):
+        remaining = []
+        for entry in slot:
+            if entry.cancelled:
+                continue
+            if entry.fire_tick > self._current_tick:
+                remaining.append(entry)  # Not this revolution
+                continue
+            self._fire(entry)
+        slot[:] = remaining
+
+    def _fire(self, entry):
+        jitter = self._clock() - entry.fire_time
+        if jitter < 0.0:
+            jitter = 0.0  # Fired within the tick that contains fire_time
+
+        self._jitter_count += 1
+        self._jitter_total += jitter
+        if jitter > self._jitter_max:
+            self._jitter_max = jitter
+        if self._jitter_budget is not None and jitter > self._jitter_budget:
+            self._jitter_late += 1
+            self._logger.warning('Cue [%s] sound [%s] fired %.1fms late' %
+                                 (entry.cue_name, entry.sound_name, jitter * 1000.0))
+
+        pending = self._pending.get(entry.cue_name)
+        if pending is not None:
+            pending.remove(entry)
+            if not pending:
+                del self._pending[entry.cue_name]
+        self._started.setdefault(entry.cue_name, []).append(entry.sound_name)
+
+        self._play_callback(entry.sound_name, entry.loop)
+
+    def getJitterStats(self):
+        """Returns a dictionary describing how late scheduled sounds were actually played
+
+        Returns:
+            {dict} -- {'count': <int>, 'mean': <float>, 'max': <float>, 'late': <int>, 'budget': <float>}
+        """
+        mean = 0.0
+        if self._jitter_count:
+            mean = self._jitter_total / self._jitter_count
+        return {'count': self._jitter_count,
+                'mean': mean,
+                'max': self._jitter_max,
+                'late': self._jitter_late,
+                'budget': self._jitter_budget}
@@ -0,0 +1,188 @@
+"""Plays long sound files by streaming chunks from disk instead of decoding the whole file
+
+Only the first chunk is decoded up front, so starting a streamed sound is as fast as
+starting an in-memory one.  After that, the next chunk is queued onto the playing
+channel whenever the channel has room for it (see StreamingSound.service).
+"""
+
+import audioop
+import logging
+import mmap
+import wave
+
+import pygame
+
+
+class StreamingSound(object):
+    """Stands in for a pygame.mixer.Sound, but only keeps a small rolling buffer in memory
+
+    example usage:
+
+    snd = StreamingSound('audio_files/startup_sweep.wav')
+    snd.play()
+    while snd.isPlaying():
+        snd.service()
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, file_path, chunk_seconds=0.25, memory_map=False):
+        """Opens the file and preloads the first chunk
+
+        Arguments:
+            file_path {str} -- Path to the wav file
+
+        Keyword Arguments:
+            chunk_seconds {float} -- Length of each chunk handed to the mixer (default: {0.25})
+            memory_map {bool} -- Read the file through a read-only memory map instead of file reads (default: {False})
+        """
+        self._file_path = file_path
+
+        self._file = open(file_path, 'rb')
+        self._mmap = None
+        if memory_map:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._wave = wave.open(self._mmap)
+        else:
+            self._wave = wave.open(self._file)
+
+        self._in_rate = self._wave.getframerate()
+        self._in_width = self._wave.getsampwidth()
+        self._in_channels = self._wave.getnchannels()
+
+        # The chunks we hand over to pygame must already be in the mixer format
+        self._out_rate, out_size, self._out_channels = pygame.mixer.get_init()
+        self._out_width = abs(out_size) // 8
+
+        self._chunk_frames = max(1, int(self._in_rate * chunk_seconds))
+
+        self._channel = None
+        self._loops_remaining = 0
+        self._queued = None
+        self._playing = None
+
+        self._first_chunk = self._readChunk(rewind=True)
+        self._second_chunk_frame = self._wave.tell()
+        self._ratecv_state_after_first = self._ratecv_state
+
+    def _convert(self, frames):
+        """Converts raw frames from the file format to the mixer format"""
+        if self._in_width == 1:
+            frames = audioop.bias(frames, 1, -128)  # 8 bit wav data is unsigned
+        if self._in_width != self._out_width:
+            frames = audioop.lin2lin(frames, self._in_width, self._out_width)
+        if self._in_channels == 2 and self._out_channels == 1:
+            frames = audioop.tomono(frames, self._out_width, 0.5, 0.5)
+        elif self._in_channels == 1 and self._out_channels == 2:
+            frames = audioop.tostereo(frames, self._out_width, 1, 1)
+        if self._in_rate != self._out_rate:
+            frames, self._ratecv_state = audioop.ratecv(frames, self._out_width, self._out_channels,
+                                                        self._in_rate, self._out_rate,
+                                                        self._ratecv_state)
+        return frames
+
+    def _readChunk(self, rewind=False):
+        """Reads and converts the next chunk of the file
+
+        Keyword Arguments:
+            rewind {bool} -- Start again from the beginning of the file (default: {False})
+
+        Returns:
+            {pygame.mixer.Sound} -- The chunk, or None if the end of the file was reached
+        """
+        if rewind:
+            self._wave.rewind()
+            self._ratecv_state = None
+
+        frames = self._wave.readframes(self._chunk_frames)
+        if not frames:
+            return None
+        return pygame.mixer.Sound(buffer=self._convert(frames))
+
+    def _nextChunk(self):
+        """Returns the chunk which follows the one queued last, taking looping into account"""
+        chunk = self._readChunk()
+        if chunk is not None:
+            return chunk
+
+        if self._loops_remaining == 0:
+            return None
+        if self._loops_remaining > 0:
+            self._loops_remaining -= 1
+
+        # Back to the top:  The preloaded first chunk is reused, so pick up reading after it
+        self._wave.setpos(self._second_chunk_frame)
+        self._ratecv_state = self._ratecv_state_after_first
+        return self._first_chunk
+
+    def play(self, loops=0):
+        """Starts the stream on a free channel
+
+        Keyword Arguments:
+            loops {int} -- Number of extra times to play the sound, -1 to repeat forever (default: {0})
+
+        Returns:
+            {pygame.mixer.Channel} -- The channel the stream is playing on
+        """
+        self.stop()
+
+        self._channel = pygame.mixer.find_channel(True)
+        self._loops_remaining = loops
+        self._wave.setpos(self._second_chunk_frame)
+        self._ratecv_state = self._ratecv_state_after_first
+
+        self._playing = self._first_chunk
+        self._channel.play(self._first_chunk)
+        self.service()
+        return self._channel
+
+    def stop(self):
+        """Stops the stream, if it is playing"""
+        if self._channel is not None and self._ownsChannel():
+            self._channel.stop()
+        self._channel = None
+        self._queued = None
+        self._playing = None
+
+    def _ownsChannel(self):
+        """Another sound may have taken the channel over, if all channels were busy"""
+        current = self._channel.get_sound()
+        return current is not None and (current is self._playing or current is self._queued)
+
+    def isPlaying(self):
+        return self._channel is not None
+
+    def service(self):
+        """Keeps the rolling buffer topped up.  Call this regularly while the stream is playing
+        """
+        if self._channel is None:
+            return
+
+        if not self._ownsChannel():
+            self._logger.debug('Stream of %s has ended' % self._file_path)
+            self._channel = None
+            self._queued = None
+            self._playing = None
+            return
+
+        if self._channel.get_queue() is not None:
+            return  # There is still a chunk waiting behind the one playing
+
+        if self._queued is not None:
+            # The chunk we queued last time has moved up to playing
+            self._playing = self._queued
+            self._queued = None
+
+        chunk = self._nextChunk()
+        if chunk is None:
+            return  # Let the last chunk play out
+        self._channel.queue(chunk)
+        self._queued = chunk
+
+    def release(self):
+        """Closes the underlying file"""
+        self.stop()
+        self._wave.close()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
@@ -0,0 +1,340 @@
+"""Columnar log of every routed event, and the audio command it produced
+
+Each event is one fixed-width little-endian record, so a weekend of traffic is a single
+flat file which numpy maps straight into a structured array:
+
+    time            f8    Ingress time if the event was traced, else the time it was routed
+    component       u2    \\
+    action          u2     | Ids into the string table
+    sound           u2    /  (0 if the event produced no sound)
+    value           f4    The event's value, if it is a number (switch positions, pot
+                          readings, encoder deltas), else NaN
+    command         u1    0 no command, 1 play, 2 stop
+    parse_latency   f4    serial_read -> parse     (NaN unless traced)
+    queue_latency   f4    parse -> queue_to_router (NaN unless traced)
+    map_latency     f4    Time spent in the MessageMapper
+
+Names (components, actions, sounds) are interned, and the table is kept next to the log
+as '<path>.strings' (json).  Values are never interned:  A pot alone reports hundreds of
+different readings, which would soon fill the table's 65535 ids.  Records are buffered and
+written in chunks.  The writer only needs the standard library;  the EventLog queries need
+numpy.
+
+    PYTHONPATH=. python pipeline/eventstore.py events.bin --window 300
+"""
+
+import argparse
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+RECORD_FORMAT = '<dHHHfBfff'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+FIELDS = [('time', '<f8'), ('component', '<u2'), ('action', '<u2'), ('sound', '<u2'),
+          ('value', '<f4'), ('command', 'u1'), ('parse_latency', '<f4'),
+          ('queue_latency', '<f4'), ('map_latency', '<f4')]
+
+LATENCY_FIELDS = ('parse_latency', 'queue_latency', 'map_latency')
+
+COMMAND_CODES = {'play': 1, 'stop': 2}
+
+NAN = float('nan')
+
+
+def _stringsPath(path):
+    return path + '.strings'
+
+
+def _numericValue(value):
+    """Returns the value as a float, or NaN if it isn't a number (e.g. 'n/a', or a state dump)"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def _loadStrings(path):
+    try:
+        with open(_stringsPath(path)) as f:
+            return json.load(f)
+    except IOError:
+        return ['']
+
+
+class EventStore(object):
+    """Appends routed events to the columnar log
+
+    example usage:
+
+    store = EventStore('events.bin')
+    store.record(event_message, audio_command, map_latency)
+    store.close()
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, path, chunk_records=4096):
+        """Initialize the EventStore.  An existing log is appended to
+
+        Arguments:
+            path {str} -- Path of the log file
+
+        Keyword Arguments:
+            chunk_records {int} -- Records buffered before they are written out (default: {4096})
+        """
+        self._path = path
+        self._chunk_records = chunk_records
+
+        # String id 0 is the empty string, used for 'no sound'
+        self._strings = _loadStrings(path)
+        self._string_ids = dict((string, i) for i, string in enumerate(self._strings))
+        self._strings_written = len(self._strings)
+        self._table_full = False
+
+        self._file = open(path, 'ab')
+        self._pending = []
+
+        self.recordsWritten = 0
+
+    def _intern(self, string):
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            if len(self._strings) > 0xffff:
+                if not self._table_full:
+                    self._logger.error('Event store string table is full, new names are logged as empty strings')
+                    self._table_full = True
+                return 0
+            string_id = len(self._strings)
+            self._strings.append(string)
+            self._string_ids[string] = string_id
+        return string_id
+
+    def record(self, event_message, audio_command=None, map_latency=NAN):
+        """Adds one routed event to the log
+
+        Arguments:
+            event_message {EventMessage} -- The event
+
+        Keyword Arguments:
+            audio_command {AudioCommand} -- Command the event produced, if any (default: {None})
+            map_latency {float} -- Seconds the MessageMapper took for the event (default: {NaN})
+        """
+        now = time.time()
+        parse_latency = queue_latency = NAN
+        trace = event_message.trace
+        if trace is not None and len(trace.stamps) >= 3:
+            now = trace.stamps[0][1]
+            parse_latency = trace.stamps[1][1] - trace.stamps[0][1]
+            queue_latency = trace.stamps[2][1] - trace.stamps[1][1]
+
+        sound = command = 0
+        if audio_command is not None:
+            sound = self._intern(audio_command.name)
+            command = COMMAND_CODES.get(audio_command.action, 0)
+
+        self._pending.append(struct.pack(RECORD_FORMAT, now,
+                                         self._intern(event_message.component),
+                                         self._intern(event_message.action),
+                                         sound,
+                                         _numericValue(event_message.value),
+                                         command,
+                                         parse_latency, queue_latency, map_latency))
+        if len(self._pending) >= self._chunk_records:
+            self.flush()
+
+    def _writeStrings(self):
+        """Replaces the string table, through a rename so a reader never sees it half written"""
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._strings, f)
+        os.rename(temp_path, _stringsPath(self._path))
+        self._strings_written = len(self._strings)
+
+    def flush(self):
+        """Writes the buffered records (and any new strings) out"""
+        # Strings go first, so every id in the log can always be looked up
+        if len(self._strings) != self._strings_written:
+            self._writeStrings()
+        if not self._pending:
+            return
+        self._file.write(b''.join(self._pending))
+        self._file.flush()
+        self.recordsWritten += len(self._pending)
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class EventLog(object):
+    """Read-only, memory-mapped view of an event log, with vectorised queries
+
+    example usage:
+
+    log = EventLog('events.bin')
+    log.componentCounts()
+    log.between(saturday_open, saturday_close).busiestWindows(300)
+    """
+
+    def __init__(self, path, records=None, strings=None):
+        """Maps the log
+
+        Arguments:
+            path {str} -- Path of the log file
+
+        Keyword Arguments:
+            records {numpy.ndarray} -- Use these records instead of mapping the file (used by between()) (default: {None})
+            strings {list} -- String table to go with records (default: {None})
+        """
+        if numpy is None:
+            raise ImportError('numpy is required to query the event log')
+
+        self._path = path
+        if records is None:
+            strings = _loadStrings(path)
+            # Ignore a trailing partial record from a writer which is still running
+            count = os.path.getsize(path) // RECORD_SIZE
+            if count:
+                records = numpy.memmap(path, dtype=numpy.dtype(FIELDS), mode='r', shape=(count,))
+            else:
+                records = numpy.zeros(0, dtype=numpy.dtype(FIELDS))
+        self.records = records
+        self._strings = strings
+
+    def __len__(self):
+        return len(self.records)
+
+    def _idOf(self, string):
+        try:
+            return self._strings.index(string)
+        except ValueError:
+            return None
+
+    def _namedCounts(self, ids):
+        counts = numpy.bincount(ids, minlength=len(self._strings))
+        return dict((self._strings[i], int(counts[i])) for i in numpy.nonzero(counts)[0])
+
+    def between(self, start=None, end=None):
+        """Returns an EventLog of the records with start <= time < end
+
+        Keyword Arguments:
+            start {float} -- Earliest time, None for the start of the log (default: {None})
+            end {float} -- Time to stop before, None for the end of the log (default: {None})
+        """
+        times = self.records['time']
+        mask = numpy.ones(len(times), dtype=bool)
+        if start is not None:
+            mask &= times >= start
+        if end is not None:
+            mask &= times < end
+        return EventLog(self._path, self.records[mask], self._strings)
+
+    def componentCounts(self):
+        """Returns a dictionary of component name to number of events"""
+        return self._namedCounts(self.records['component'])
+
+    def soundCounts(self):
+        """Returns a dictionary of sound name to number of commands for it"""
+        sounds = self.records['sound']
+        return self._namedCounts(sounds[sounds != 0])
+
+    def interArrivalHistogram(self, component=None, bins=50, max_seconds=None):
+        """Histogram of the time between consecutive events
+
+        Keyword Arguments:
+            component {str} -- Only look at this component's events, None for all of them (default: {None})
+            bins {int} -- Number of bins (default: {50})
+            max_seconds {float} -- Gaps longer than this are left out (e.g. closing hours) (default: {None})
+
+        Returns:
+            {tuple} -- (counts, bin_edges), as from numpy.histogram
+        """
+        times = self.records['time']
+        if component is not None:
+            times = times[self.records['component'] == self._idOf(component)]
+        gaps = numpy.diff(numpy.sort(times))
+        if max_seconds is not None:
+            gaps = gaps[gaps <= max_seconds]
+        return numpy.histogram(gaps, bins=bins)
+
+    def latencyPercentiles(self, field='map_latency', percentiles=(50, 90, 99, 99.9)):
+        """Returns a dictionary of percentile to latency (seconds), for the records which have one
+
+        Keyword Arguments:
+            field {str} -- One of LATENCY_FIELDS (default: {'map_latency'})
+            percentiles {tuple} -- Percentiles to compute (default: {(50, 90, 99, 99.9)})
+        """
+        if field not in LATENCY_FIELDS:
+            raise ValueError('Unknown latency field [%s]' % field)
+        latencies = self.records[field]
+        latencies = latencies[~numpy.isnan(latencies)]
+        if not len(latencies):
+            return {}
+        values = numpy.percentile(latencies, percentiles)
+        return dict(zip(percentiles, (float(value) for value in values)))
+
+    def busiestWindows(self, window=60.0, top=10):
+        """Returns the busiest time windows, busiest first
+
+        Arguments:
+            window {float} -- Window length in seconds.  Windows are aligned to multiples of it
+
+        Keyword Arguments:
+            top {int} -- Number of windows to return (default: {10})
+
+        Returns:
+            {list} -- (window start time, number of events) tuples
+        """
+        if not len(self.records):
+            return []
+        slots = numpy.floor(self.records['time'] / window).astype(numpy.int64)
+        slot_ids, counts = numpy.unique(slots, return_counts=True)
+        busiest = numpy.argsort(counts, kind='mergesort')[::-1][:top]
+        return [(float(slot_ids[i] * window), int(counts[i])) for i in busiest]
+
+
+def parse_arguments(argv):
+
+    parser = argparse.ArgumentParser(description='Summarizes an event log')
+    parser.add_argument("path", help="Event log file")
+    parser.add_argument("-w", "--window", dest="window", type=float, default=60.0,
+                        help="Window length, in seconds, for the busiest windows")
+    parser.add_argument("-n", "--top", dest="top", type=int, default=10,
+                        help="Number of components/windows to list")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+
+    start = time.time()
+    log = EventLog(args.path)
+    counts = log.componentCounts()
+    windows = log.busiestWindows(args.window, args.top)
+    percentiles = log.latencyPercentiles()
+    elapsed = time.time() - start
+
+    print('%d events, analysed in %.2fs' % (len(log), elapsed))
+    print('\nBusiest components:')
+    for component, count in sorted(counts.items(), key=lambda item: -item[1])[:args.top]:
+        print('  %-20s %d' % (component, count))
+    print('\nBusiest %gs windows:' % args.window)
+    for window_start, count in windows:
+        print('  %s  %d' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(window_start)), count))
+    print('\nMapper latency percentiles:')
+    for percentile in sorted(percentiles):
+        print('  p%-5g %.1fus' % (percentile, percentiles[percentile] * 1000000.0))
@@ -0,0 +1,239 @@
+"""Fans audio commands out over UDP to any number of AudioController nodes
+
+The publisher sits after the MessageMapper and sends each AudioCommand as one small json
+datagram, either to a multicast group or to a list of (unicast) node addresses.  Each
+node reads them through an AudioCommandSubscriber, which looks like a queue to the
+AudioController, so it can go straight into its queue list.
+
+Every datagram carries the publisher's id and a sequence number.  Subscribers drop
+anything at or below the last sequence number seen from that publisher (duplicates and
+stale, reordered commands), and anything not addressed to one of their zones.  A restarted
+publisher picks a new id, so its fresh sequence numbers are not mistaken for stale ones.
+"""
+
+import collections
+import errno
+import json
+import logging
+import os
+import random
+import socket
+import struct
+import time
+import Queue
+
+from messages import AudioCommand
+
+
+DEFAULT_GROUP = ('239.255.42.1', 5005)
+
+# Zone which every subscriber listens to
+ALL_ZONES = 'all'
+
+
+def _isMulticast(host):
+    try:
+        return 224 <= int(host.split('.')[0]) <= 239
+    except ValueError:
+        return False
+
+
+class AudioCommandPublisher(object):
+    """Sends AudioCommands to the audio nodes.  publish() never blocks
+
+    example usage:
+
+    publisher = AudioCommandPublisher([('239.255.42.1', 5005)], zone_map={'heat_warning': 'bridge'})
+    publisher.publish(audio_command)
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, destinations=None, zone_map=None, ttl=1):
+        """Initialize the AudioCommandPublisher
+
+        Keyword Arguments:
+            destinations {list} -- (host, port) tuples:  Multicast groups and/or node addresses (default: {[DEFAULT_GROUP]})
+            zone_map {dict} -- Sound name to zone.  Sounds which aren't in it go to every zone (default: {None})
+            ttl {int} -- Multicast time to live (1 keeps it on the local network) (default: {1})
+        """
+        if destinations is None:
+            destinations = [DEFAULT_GROUP]
+        self._destinations = destinations
+        self._zone_map = zone_map or {}
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self._socket.setblocking(False)
+
+        self._publisher_id = '%x%04x' % (os.getpid(), random.getrandbits(16))
+        self._sequence = 0
+
+        self.sentCount = 0
+        self.dropCount = 0
+
+    def publish(self, audio_command, zone=None):
+        """Sends the command to every destination
+
+        Arguments:
+            audio_command {AudioCommand} -- Command to send
+
+        Keyword Arguments:
+            zone {str} -- Zone the command is for.  Looked up in the zone map if None (default: {None})
+        """
+        if zone is None:
+            zone = self._zone_map.get(audio_command.name, ALL_ZONES)
+
+        self._sequence += 1
+        datagram = json.dumps({'p': self._publisher_id,
+                               's': self._sequence,
+                               'z': zone,
+                               't': time.time(),
+                               'a': audio_command.action,
+                               'n': audio_command.name,
+                               'l': audio_command.loop}, separators=(',', ':')).encode('utf-8')
+
+        for destination in self._destinations:
+            try:
+                self._socket.sendto(datagram, destination)
+                self.sentCount += 1
+            except socket.error as err:
+                # A full socket buffer must not hold up the router, the command is dropped
+                if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                    self._logger.error('Failed publishing to %s:%s: %s' % (destination[0], destination[1], err))
+                self.dropCount += 1
+
+    def close(self):
+        self._socket.close()
+
+
+class AudioCommandSubscriber(object):
+    """Receives AudioCommands for the given zones.  Has the empty()/get() methods the
+    AudioController uses on its queues
+
+    example usage:
+
+    subscriber = AudioCommandSubscriber(['bridge'])
+    ac = AudioController(audio_config, [subscriber])
+    ac.consumeMessages()
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, zones, address=DEFAULT_GROUP, interface='0.0.0.0', receive_buffer=1 << 20):
+        """Initialize the AudioCommandSubscriber
+
+        Arguments:
+            zones {list} -- Zones this node plays.  Commands for ALL_ZONES are always accepted
+
+        Keyword Arguments:
+            address {tuple} -- (host, port) to listen on.  A multicast group is joined (default: {DEFAULT_GROUP})
+            interface {str} -- Address of the interface to join the multicast group on (default: {'0.0.0.0'})
+            receive_buffer {int} -- Socket receive buffer size, so bursts aren't lost while the node is busy (default: {1 << 20})
+        """
+        self._zones = set(zones)
+        self._zones.add(ALL_ZONES)
+
+        host, port = address
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        if _isMulticast(host):
+            # Several nodes on one machine can share the group port
+            if hasattr(socket, 'SO_REUSEPORT'):
+                self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self._socket.bind(('', port))
+            membership = struct.pack('4s4s', socket.inet_aton(host), socket.inet_aton(interface))
+            self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        else:
+            self._socket.bind((host, port))
+        self._socket.setblocking(False)
+
+        self._ready = collections.deque()
+
+        # publisher id -> last sequence number seen
+        self._last_sequence = {}
+
+        self.receivedCount = 0
+        self.staleCount = 0
+        self.otherZoneCount = 0
+        self.invalidCount = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def _receive(self):
+        """Reads every datagram which is waiting on the socket"""
+        while True:
+            try:
+                datagram = self._socket.recv(4096)
+            except socket.error as err:
+                if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self._logger.error('Failed receiving audio commands: %s' % err)
+                return
+            self._accept(datagram)
+
+    def _accept(self, datagram):
+        try:
+            message = json.loads(datagram.decode('utf-8'))
+            publisher_id = message['p']
+            sequence = message['s']
+            zone = message['z']
+            command = AudioCommand(message['a'], message['n'], message['l'])
+        except (ValueError, KeyError, TypeError) as err:
+            self._logger.error('Invalid audio command datagram: %s' % err)
+            self.invalidCount += 1
+            return
+
+        if sequence <= self._last_sequence.get(publisher_id, 0):
+            self.staleCount += 1
+            return
+        self._last_sequence[publisher_id] = sequence
+
+        if zone not in self._zones:
+            self.otherZoneCount += 1
+            return
+
+        latency = time.time() - message.get('t', time.time())
+        self._latency_total += latency
+        self._latency_max = max(self._latency_max, latency)
+        self.receivedCount += 1
+
+        self._ready.append(command)
+
+    def empty(self):
+        self._receive()
+        return not self._ready
+
+    def get(self, block=True, timeout=None):
+        """Returns the next command for this node
+
+        Raises:
+            Queue.Empty -- If no command is available (after timeout, if blocking)
+        """
+        deadline = None
+        if block and timeout is not None:
+            deadline = time.time() + timeout
+
+        while True:
+            self._receive()
+            if self._ready:
+                return self._ready.popleft()
+            if not block or (deadline is not None and time.time() >= deadline):
+                raise Queue.Empty
+            time.sleep(0.001)
+
+    def getStats(self):
+        """Returns counts of received/dropped commands, and the publish to receive latency"""
+        mean_latency = 0.0
+        if self.receivedCount:
+            mean_latency = self._latency_total / self.receivedCount
+        return {'received': self.receivedCount,
+                'stale': self.staleCount,
+                'other_zone': self.otherZoneCount,
+                'invalid': self.invalidCount,
+                'mean_latency': mean_latency,
+                'max_latency': self._latency_max}
+
+    def close(self):
+        self._socket.close()
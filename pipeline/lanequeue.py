@@ -0,0 +1,294 @@
+"""Bounded queue with priority lanes, for passing messages between the pipeline processes
+
+Messages are sorted into lanes by a classifier (control/state messages vs. cosmetic sounds).
+Each lane is bounded and has its own overflow policy, so a burst of button presses can't
+build up seconds of stale sounds ahead of a 'stop' or a 'shutdown_sequence'.  get() serves
+the lanes in priority order;  get_many() hands out everything which is ready at once, in
+the order it was put.
+"""
+
+import collections
+import logging
+import multiprocessing
+import operator
+import Queue
+import time
+
+from messages import AudioCommand
+
+
+CONTROL_LANE = 0
+COSMETIC_LANE = 1
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+COALESCE = 'coalesce'
+
+DEFAULT_LANES = [
+    {'name': 'control',  'maxsize': 256, 'policy': DROP_OLDEST},
+    {'name': 'cosmetic', 'maxsize': 16,  'policy': COALESCE}
+]
+
+# Input events are never coalesced:  A button's press and its release share a component, and
+# keeping only the release would lose the press (the only one of the two which plays a sound)
+EVENT_LANES = [
+    {'name': 'control',  'maxsize': 256, 'policy': DROP_OLDEST},
+    {'name': 'cosmetic', 'maxsize': 16,  'policy': DROP_OLDEST}
+]
+
+# Components whose events change the panel state (or start/stop a looping sound),
+# so must never be dropped behind button mashing
+CONTROL_COMPONENTS = frozenset(['controller01', 'controller02', 'key', 'switch-07'])
+
+# Sounds which announce a change of the whole panel
+CRITICAL_SOUNDS = frozenset(['shutdown_sequence', 'power_restored', 'systems_nominal',
+                             'initialization_sequence', 'power_up'])
+
+
+def classifyEventMessage(event_message):
+    """Lane classifier for microcontroller event messages (serial processor -> router).  Use
+    it with EVENT_LANES
+
+    Arguments:
+        event_message {EventMessage} -- Event as extracted from json payload of arduino message
+
+    Returns:
+        {int} -- CONTROL_LANE or COSMETIC_LANE
+    """
+    if event_message.component in CONTROL_COMPONENTS or \
+       event_message.action in ('setup_complete', 'stateread', 'statedump'):
+        return CONTROL_LANE
+    return COSMETIC_LANE
+
+
+def classifyAudioCommand(audio_message):
+    """Lane classifier for audiocontroller messages (router -> audiocontroller)
+
+    Anything which is not a one-shot play (stops, loops, end_thread) is a control message
+
+    Arguments:
+        audio_message {AudioCommand} -- Command for the audiocontroller
+
+    Returns:
+        {int} -- CONTROL_LANE or COSMETIC_LANE
+    """
+    if audio_message.action != 'play' or audio_message.loop or \
+       audio_message.name in CRITICAL_SOUNDS:
+        return CONTROL_LANE
+    return COSMETIC_LANE
+
+
+def messageKey(message):
+    """Coalescing key:  The sound name for audio messages, the component for event messages"""
+    if isinstance(message, AudioCommand):
+        return message.name
+    return message.component
+
+
+class PriorityLaneQueue(object):
+    """Drop-in replacement for multiprocessing.Queue (put/get/empty) with bounded priority lanes
+
+    The queue is created in the parent process and passed to the producer and consumer
+    processes.  Each lane has its own pipe, so a control message never waits behind
+    cosmetic ones.  The overflow policy is applied on the consumer side, as messages are
+    pulled off the pipes into per-lane buffers.
+
+    example usage:
+
+    q = PriorityLaneQueue(classifyAudioCommand)
+    q.put(AudioCommand('play', 'blip_low'))
+    if not q.empty():
+        message = q.get(block=False)
+
+    A batch (put_many) crosses a single pipe as one message, and is unpacked into the lane
+    buffers, so the lane policies apply to every message in it.  Every message is put with
+    a sequence number (the time it was put, and a count), so get_many can hand out what is
+    ready in the order it was put, whatever its lane
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, classifier, lanes=None, key=messageKey):
+        """Initialize the PriorityLaneQueue
+
+        Arguments:
+            classifier {function} -- Returns the lane index for a message.  Must be a module level function
+
+        Keyword Arguments:
+            lanes {list} -- Lane configs in priority order:  [{'name': <str>, 'maxsize': <int>, 'policy': <str>, 'pipe_maxsize': <int>}] (default: {DEFAULT_LANES})
+            key {function} -- Returns the key messages are coalesced by (default: {messageKey})
+        """
+        if lanes is None:
+            lanes = DEFAULT_LANES
+
+        for lane in lanes:
+            if lane['policy'] not in (DROP_OLDEST, DROP_NEWEST, COALESCE):
+                raise ValueError('Unknown overflow policy [%s] for lane %s' % (lane['policy'], lane['name']))
+
+        self._classifier = classifier
+        self._key = key
+        self._lanes = lanes
+
+        # The pipes only need a bound to protect against a consumer which has stopped
+        # altogether.  Normal overflow is handled by the lane policy on the consumer side
+        self._pipe_sizes = [lane.get('pipe_maxsize', lane['maxsize'] * 4) for lane in lanes]
+        self._pipes = [multiprocessing.Queue(size) for size in self._pipe_sizes]
+
+        # Shared between processes, so drops on the producer side are counted too
+        self._drop_counts = multiprocessing.Array('L', len(lanes))
+
+        # Consumer side buffers of (sequence number, message).  Each process gets its own (empty) copy
+        self._buffers = [collections.deque() for _ in lanes]
+
+        # Breaks ties between messages put at the same time.  Each producer counts on its own copy
+        self._count = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buffers'] = [collections.deque() for _ in self._lanes]
+        return state
+
+    def _countDrop(self, lane_index):
+        with self._drop_counts.get_lock():
+            self._drop_counts[lane_index] += 1
+
+    def put(self, message, block=True, timeout=None):
+        """Puts the message on the pipe of its lane.  Never blocks:  If the pipe itself is full,
+        the consumer is not keeping up at all, and the message is dropped.
+
+        None is never queued, since consumers skip over it anyway
+        """
+        if message is None:
+            return
+
+        lane_index = self._classifier(message)
+        self._count += 1
+        try:
+            self._pipes[lane_index].put_nowait((lane_index, (time.time(), self._count), message))
+        except Queue.Full:
+            self._logger.warning('Lane %s is full, dropping %s' % (self._lanes[lane_index]['name'], message))
+            self._countDrop(lane_index)
+
+    def put_many(self, messages):
+        """Puts a batch of messages on the queue, with a single pipe write rather than one per
+        message.  Like put(), never blocks, and skips None
+
+        The whole batch goes through the pipe of the highest priority lane in it, and is only
+        sorted into the lanes on the consumer side:  So it arrives all at once, and get_many
+        hands it out in order, e.g. a 'play' (cosmetic) ahead of the 'stop' (control) which
+        followed it
+
+        Arguments:
+            messages {list} -- Messages, in order
+        """
+        now = time.time()
+        batch = []
+        for message in messages:
+            if message is not None:
+                self._count += 1
+                batch.append((self._classifier(message), (now, self._count), message))
+        if not batch:
+            return
+
+        pipe_index = min(item[0] for item in batch)
+        try:
+            # A list on the pipe is a batch;  a single message is a (lane, sequence number, message) tuple
+            self._pipes[pipe_index].put_nowait(batch if len(batch) > 1 else batch[0])
+        except Queue.Full:
+            self._logger.warning('Lane %s is full, dropping a batch of %d' % (self._lanes[pipe_index]['name'], len(batch)))
+            with self._drop_counts.get_lock():
+                for item in batch:
+                    self._drop_counts[item[0]] += 1
+
+    def _admit(self, lane_index, item):
+        """Adds a (sequence number, message) item to the consumer side buffer of a lane, applying
+        the lane's overflow policy"""
+        lane = self._lanes[lane_index]
+        buf = self._buffers[lane_index]
+
+        if lane['policy'] == COALESCE:
+            key = self._key(item[1])
+            for i, queued in enumerate(buf):
+                if self._key(queued[1]) == key:
+                    # Only the latest message for a key is worth anything
+                    del buf[i]
+                    self._countDrop(lane_index)
+                    break
+
+        if len(buf) >= lane['maxsize']:
+            self._countDrop(lane_index)
+            if lane['policy'] == DROP_NEWEST:
+                return
+            buf.popleft()
+
+        buf.append(item)
+
+    def _drain(self):
+        """Moves everything which is ready from the pipes into the lane buffers"""
+        for lane_index, pipe in enumerate(self._pipes):
+            # Bounded, so a flooded lane can't keep us here forever
+            remaining = self._pipe_sizes[lane_index]
+            while remaining:
+                remaining -= 1
+                try:
+                    item = pipe.get_nowait()
+                except Queue.Empty:
+                    break
+                if type(item) is list:
+                    for batched in item:
+                        self._admit(batched[0], batched[1:])
+                else:
+                    self._admit(item[0], item[1:])
+
+    def empty(self):
+        self._drain()
+        for buf in self._buffers:
+            if buf:
+                return False
+        return True
+
+    def get(self, block=True, timeout=None):
+        """Returns the oldest message of the highest priority lane which has one
+
+        Raises:
+            Queue.Empty -- If no message is available (after timeout, if blocking)
+        """
+        deadline = None
+        if block and timeout is not None:
+            deadline = time.time() + timeout
+
+        while True:
+            self._drain()
+            for buf in self._buffers:
+                if buf:
+                    return buf.popleft()[1]
+
+            if not block or (deadline is not None and time.time() >= deadline):
+                raise Queue.Empty
+            time.sleep(0.001)
+
+    def get_many(self, max_count=None):
+        """Returns everything which is ready (up to max_count messages), in the order it was put.
+        Never blocks
+
+        Lanes are only served in priority order when there is more than max_count:  The
+        messages handed out are taken from the highest priority lanes first, then put back in
+        order, so that e.g. a 'play' and the 'stop' which followed it don't swap places
+
+        Keyword Arguments:
+            max_count {int} -- Most messages to return, None for no limit (default: {None})
+
+        Returns:
+            {list} -- The messages, possibly none
+        """
+        self._drain()
+        items = []
+        for buf in self._buffers:
+            while buf and (max_count is None or len(items) < max_count):
+                items.append(buf.popleft())
+        items.sort(key=operator.itemgetter(0))
+        return [item[1] for item in items]
+
+    def getDropCounts(self):
+        """Returns a dictionary of lane name to the number of messages dropped from that lane"""
+        return dict((lane['name'], self._drop_counts[i]) for i, lane in enumerate(self._lanes))
@@ -0,0 +1,112 @@
+"""Message types passed between the pipeline stages
+
+EventMessage -- An event from a microcontroller (serialprocessor -> MessageMapper)
+AudioCommand -- A command for the audiocontroller (MessageMapper -> AudioController)
+
+Both are immutable tuples with no per-instance __dict__, so they are small, cheap to
+pickle across processes, and can be preallocated and shared.  They are validated once,
+when constructed, so later stages can rely on their structure.
+"""
+
+import collections
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+AUDIO_ACTIONS = frozenset(['play', 'stop', 'end_thread'])
+
+
+# Messages unpickle through these rather than __new__, so they aren't validated a second
+# time, and each pickle carries a single short global reference
+def _ev(*values):
+    return tuple.__new__(EventMessage, values)
+
+
+def _ac(*values):
+    return tuple.__new__(AudioCommand, values)
+
+
+class EventMessage(collections.namedtuple('EventMessage', ['action', 'component', 'value', 'element', 'trace'])):
+    """Event from a microcontroller, e.g.
+
+    EventMessage(action='switch', component='switch-30', value='1', element='n/a')
+
+    trace is a pipeline.tracing.Trace if the event was sampled for tracing, None else
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, action, component, value='n/a', element='n/a', trace=None):
+        if not isinstance(action, string_types):
+            raise ValueError('Event action must be a string, not %s' % type(action))
+        if not isinstance(component, string_types):
+            raise ValueError('Event component must be a string, not %s' % type(component))
+        return super(EventMessage, cls).__new__(cls, action, component, value, element, trace)
+
+    def __reduce__(self):
+        return (_ev, tuple(self))
+
+    @classmethod
+    def fromDict(cls, event_dict, trace=None):
+        """Builds an EventMessage from the dictionary decoded from an arduino json message
+
+        Arguments:
+            event_dict {dict} -- {'action': <str>, 'component': <str>, 'value': <str>, 'element': <str>}
+
+        Keyword Arguments:
+            trace {Trace} -- Trace for the event, if it was sampled (default: {None})
+
+        Raises:
+            ValueError -- If the dictionary is not a properly structured event
+
+        Returns:
+            {EventMessage} -- The event
+        """
+        if type(event_dict) is not dict:
+            raise ValueError('Event must be a dict, not %s' % type(event_dict))
+        if 'action' not in event_dict or 'component' not in event_dict:
+            raise ValueError('Event is missing "action" or "component": %s' % event_dict)
+        return cls(event_dict['action'], event_dict['component'],
+                   event_dict.get('value', 'n/a'), event_dict.get('element', 'n/a'), trace)
+
+
+class AudioCommand(collections.namedtuple('AudioCommand', ['action', 'name', 'loop', 'trace'])):
+    """Command for the audiocontroller, e.g.
+
+    AudioCommand(action='play', name='reactor_online', loop=False)
+
+    trace carries on the Trace of the event the command was made for, if it was sampled
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, action, name, loop=False, trace=None):
+        if action not in AUDIO_ACTIONS:
+            raise ValueError('Unknown audio action [%s]' % action)
+        if action != 'end_thread' and not isinstance(name, string_types):
+            raise ValueError('Audio command name must be a string, not %s' % type(name))
+        return super(AudioCommand, cls).__new__(cls, action, name, bool(loop), trace)
+
+    def __reduce__(self):
+        return (_ac, tuple(self))
+
+    @classmethod
+    def fromDict(cls, audio_dict):
+        """Builds an AudioCommand from an {'action': <str>, 'name': <str>, 'loop': <bool>} dictionary
+
+        Raises:
+            ValueError -- If the dictionary is not a properly structured command
+
+        Returns:
+            {AudioCommand} -- The command
+        """
+        if type(audio_dict) is not dict or 'action' not in audio_dict:
+            raise ValueError('Improperly structured audio command: %s' % audio_dict)
+        return cls(audio_dict['action'], audio_dict.get('name'), audio_dict.get('loop', False))
+
+
+# Special message to end the audiocontroller thread
+END_THREAD = AudioCommand('end_thread', None)
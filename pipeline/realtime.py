@@ -0,0 +1,259 @@
+"""Opt-in real-time mode for the pipeline workers (Linux only)
+
+A worker applies a config such as this one in two steps:
+
+    {'cpu': 3, 'policy': 'fifo', 'priority': 60, 'lock_memory': True, 'gc': 'freeze'}
+
+    cpu          CPU (or list of CPUs) to pin the worker to
+    policy       'fifo' or 'rr' for SCHED_FIFO/SCHED_RR, None to keep the default scheduler
+    priority     Real-time priority, 1-99
+    lock_memory  mlockall(), so none of the worker's pages are swapped out
+    gc           'freeze' (collect once, then keep startup objects out of every later
+                 collection where Python supports it, and make collections rare),
+                 'tune' (only make collections rare), 'disable', or None
+
+applyScheduling() sets the CPU affinity and the scheduling policy.  Both belong to a thread,
+not a process:  They apply to the calling thread, and to the threads it starts afterwards
+(which inherit them), but not to threads which are already running.  So it is called
+before the worker starts its threads, in particular before pygame.mixer.init() starts the
+SDL audio thread which actually mixes the sound.  enterRealtime() then locks memory and
+quiets the garbage collector once the worker has finished loading, so that what gets
+locked is its steady state.
+
+A thread with a real-time policy is never preempted by ordinary ones, so its loop must
+block or sleep when it has nothing to do;  a busy loop would starve everything else on
+its CPU, kernel threads included.
+
+Each step is tried on its own:  Without the privileges for one (CAP_SYS_NICE, or a
+RLIMIT_MEMLOCK which is too low) a warning is logged and the worker carries on without it.
+Scheduling latency is measured before and after, and logged along with what was applied.
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import logging
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# From <sched.h> and <sys/mman.h> on Linux
+SCHED_FIFO = 1
+SCHED_RR = 2
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+POLICIES = {'fifo': SCHED_FIFO, 'rr': SCHED_RR}
+
+# Generation 0 threshold used when the gc is tuned (Python's default is 700)
+GC_THRESHOLD = 100000
+
+_logger = logging.getLogger()
+
+_libc = None
+
+
+class _SchedParam(ctypes.Structure):
+    _fields_ = [('sched_priority', ctypes.c_int)]
+
+
+def _getLibc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _libc
+
+
+def _check(result):
+    if result != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def setAffinity(cpus):
+    """Pins the calling thread (the whole worker, in a single threaded process) to the CPUs
+
+    Arguments:
+        cpus {list} -- CPU numbers
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+        return
+    mask = ctypes.c_ulong(0)
+    for cpu in cpus:
+        mask.value |= 1 << cpu
+    _check(_getLibc().sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)))
+
+
+def setScheduler(policy, priority):
+    """Switches the calling thread to a real-time scheduling policy
+
+    Arguments:
+        policy {int} -- SCHED_FIFO or SCHED_RR
+        priority {int} -- Real-time priority, 1-99
+    """
+    if hasattr(os, 'sched_setscheduler'):
+        os.sched_setscheduler(0, policy, os.sched_param(priority))
+        return
+    param = _SchedParam(priority)
+    _check(_getLibc().sched_setscheduler(0, policy, ctypes.byref(param)))
+
+
+def lockMemory():
+    """Locks the process's pages in memory
+
+    Pages allocated later are only locked too if the memlock limit is unlimited:  Under a
+    finite limit, MCL_FUTURE would make allocations fail once the limit is reached
+
+    Returns:
+        {str} -- 'current' or 'current+future'
+    """
+    flags = MCL_CURRENT
+    if resource is not None and \
+       resource.getrlimit(resource.RLIMIT_MEMLOCK)[0] == resource.RLIM_INFINITY:
+        flags |= MCL_FUTURE
+    _check(_getLibc().mlockall(flags))
+    return 'current+future' if flags & MCL_FUTURE else 'current'
+
+
+def quietGarbageCollector(mode):
+    """Collects once, then keeps the collector out of the way of the steady state
+
+    Arguments:
+        mode {str} -- 'freeze', 'tune' or 'disable'
+
+    Returns:
+        {str} -- What was done
+    """
+    gc.collect()
+    if mode == 'disable':
+        gc.disable()
+        return 'disabled'
+
+    threshold = gc.get_threshold()
+    gc.set_threshold(GC_THRESHOLD, threshold[1], threshold[2])
+    if mode == 'freeze' and hasattr(gc, 'freeze'):
+        gc.freeze()
+        return 'frozen, threshold %d' % GC_THRESHOLD
+    return 'threshold %d' % GC_THRESHOLD
+
+
+def measureSchedulingLatency(samples=200, interval=0.001):
+    """Measures how late the process wakes up from short sleeps
+
+    Arguments:
+        samples {int} -- Number of sleeps (default: {200})
+        interval {float} -- Length of each sleep (default: {0.001})
+
+    Returns:
+        {dict} -- {'mean', 'p99', 'max'} wake up delays in seconds
+    """
+    delays = []
+    for _ in range(samples):
+        start = time.time()
+        time.sleep(interval)
+        delays.append(time.time() - start - interval)
+    delays.sort()
+    return {'mean': sum(delays) / len(delays),
+            'p99': delays[min(len(delays) - 1, int(len(delays) * 0.99))],
+            'max': delays[-1]}
+
+
+def _formatLatency(latency):
+    return 'mean %.0fus, p99 %.0fus, max %.0fus' % (latency['mean'] * 1000000.0,
+                                                   latency['p99'] * 1000000.0,
+                                                   latency['max'] * 1000000.0)
+
+
+def applyScheduling(config, name='worker'):
+    """Applies the CPU affinity and scheduling policy of the real-time config to the calling
+    thread, and so to the threads it starts from now on.  Never raises for missing privileges
+
+    Arguments:
+        config {dict} -- Real-time config (see the module docstring)
+
+    Keyword Arguments:
+        name {str} -- Worker name, for the log (default: {'worker'})
+
+    Returns:
+        {dict} -- What was applied, to pass on to enterRealtime()
+    """
+    report = {'affinity': None, 'scheduler': None, 'memory': None, 'gc': None}
+    if not sys.platform.startswith('linux'):
+        _logger.warning('Real-time mode is only supported on Linux, %s runs without it' % name)
+        return report
+
+    report['latency_before'] = measureSchedulingLatency()
+
+    cpu = config.get('cpu')
+    if cpu is not None:
+        cpus = cpu if isinstance(cpu, (list, tuple)) else [cpu]
+        try:
+            setAffinity(cpus)
+            report['affinity'] = 'cpus %s' % ','.join(str(c) for c in cpus)
+        except (OSError, AttributeError) as err:
+            report['affinity'] = 'failed: %s' % err
+
+    policy = config.get('policy')
+    if policy is not None:
+        priority = config.get('priority', 50)
+        try:
+            setScheduler(POLICIES[policy], priority)
+            report['scheduler'] = '%s %d' % (policy, priority)
+        except KeyError:
+            report['scheduler'] = 'failed: unknown policy %s' % policy
+        except (OSError, AttributeError) as err:
+            report['scheduler'] = 'failed: %s' % err
+
+    return report
+
+
+def enterRealtime(config, name='worker', report=None):
+    """Applies the real-time config to the calling worker.  Never raises for missing privileges
+
+    Call it once the worker has finished loading.  The scheduling part only covers threads
+    started after it was applied, so a worker which starts threads while loading passes the
+    report of an earlier applyScheduling() instead
+
+    Arguments:
+        config {dict} -- Real-time config (see the module docstring)
+
+    Keyword Arguments:
+        name {str} -- Worker name, for the log (default: {'worker'})
+        report {dict} -- What applyScheduling() returned, if it was already called (default: {None})
+
+    Returns:
+        {dict} -- What was applied:  {'affinity', 'scheduler', 'memory', 'gc'} (each a
+                  description, or 'failed: <reason>' / None), plus 'latency_before' and 'latency_after'
+    """
+    if report is None:
+        report = applyScheduling(config, name)
+    if not sys.platform.startswith('linux'):
+        return report
+
+    if config.get('lock_memory'):
+        try:
+            report['memory'] = 'locked ' + lockMemory()
+        except (OSError, AttributeError) as err:
+            report['memory'] = 'failed: %s' % err
+
+    gc_mode = config.get('gc', 'freeze')
+    if gc_mode:
+        report['gc'] = quietGarbageCollector(gc_mode)
+
+    report['latency_after'] = measureSchedulingLatency()
+
+    for step in ('affinity', 'scheduler', 'memory'):
+        if report[step] and report[step].startswith('failed'):
+            _logger.warning('Real-time %s for %s %s' % (step, name, report[step]))
+    _logger.info('Real-time mode for %s: affinity [%s], scheduler [%s], memory [%s], gc [%s]'
+                 % (name, report['affinity'], report['scheduler'], report['memory'], report['gc']))
+    _logger.info('Scheduling latency for %s: before %s, after %s'
+                 % (name, _formatLatency(report['latency_before']), _formatLatency(report['latency_after'])))
+    return report
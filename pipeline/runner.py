@@ -0,0 +1,337 @@
+"""Wires sources and stages into a running pipeline, in one of three layouts
+
+    ingress -> parse -> debounce  |  map -> validate -> dispatch  |  AudioController
+    (one chain per source)        |  (the router)                 |
+
+INLINE     Everything on the calling thread, round robin.  No queues, no pickling, no
+           context switches:  The fastest layout on a single core (Pi Zero)
+THREADS    One thread per source chain and one for the AudioController, the router on
+           the calling thread.  Connected by lane queues
+PROCESSES  One process per source chain and one for the AudioController, kept alive by a
+           Supervisor, the router on the calling thread.  Spreads the work over the cores
+           of a Pi 4
+
+The router (and its MessageMapper) always stays on the calling thread, so the panel state
+has a single owner in every layout.  stop() ends run() in any layout:  The sources stop,
+the AudioController is sent END_THREAD, and every worker is joined.
+"""
+
+import collections
+import copy
+import logging
+import multiprocessing
+import Queue
+import threading
+import time
+
+from eventstore import EventStore
+from realtime import applyScheduling, enterRealtime
+from lanequeue import EVENT_LANES, PriorityLaneQueue, classifyAudioCommand, classifyEventMessage
+from messages import END_THREAD
+from stages import (DebounceStage, DispatchStage, MapStage, ParseStage, PublishStage, SerialSource,
+                    StageContext, ValidateStage, runStages)
+from supervisor import Supervisor
+
+from audiocontroller.audiocontroller import AudioController, audio_controller_worker
+from serialprocessor.messagemapper import MessageMapper
+
+
+INLINE = 'inline'
+THREADS = 'threads'
+PROCESSES = 'processes'
+
+MODES = (INLINE, THREADS, PROCESSES)
+
+
+def ingress_worker(source, stages, output_queue, command_queue, context, stop_event,
+                   realtime=None, heartbeat=None, poll_timeout=0.25):
+    """Polls one source, runs what it produces through the stages, and puts the result on the
+    output queue, until stop_event is set
+
+    Arguments:
+        source {Source} -- Source to poll (not opened yet)
+        stages {list} -- Stages to run every message through (not opened yet)
+        output_queue {queue} -- Queue to the router
+        command_queue {queue} -- Commands for the device behind the source
+        context {StageContext} -- Passed to each stage's open()
+        stop_event {Event} -- Set when the pipeline stops
+
+    Keyword Arguments:
+        realtime {dict} -- Real-time config for the worker, see realtime.py (default: {None})
+        heartbeat {Heartbeat} -- Beaten after every poll (default: {None})
+        poll_timeout {float} -- Longest a poll blocks, which bounds how long stopping takes (default: {0.25})
+    """
+    source.open(command_queue)
+    for stage in stages:
+        stage.open(context)
+    if realtime:
+        enterRealtime(realtime, 'ingress %s' % getattr(source, 'port_path', ''))
+    try:
+        while not stop_event.is_set():
+            # Whatever one poll returned goes to the router as one batch
+            output_queue.put_many([runStages(stages, message) for message in source.poll(poll_timeout)])
+            if heartbeat:
+                heartbeat.beat()
+    finally:
+        for stage in stages:
+            stage.close()
+        source.close()
+
+
+class _InlineQueue(collections.deque):
+    """Single threaded queue between the router and the AudioController, in INLINE mode"""
+
+    def put(self, message):
+        self.append(message)
+
+    def put_many(self, messages):
+        self.extend(message for message in messages if message is not None)
+
+    def empty(self):
+        return not self
+
+    def get_many(self, max_count=None):
+        if max_count is None or max_count >= len(self):
+            messages = list(self)
+            self.clear()
+            return messages
+        return [self.popleft() for _ in range(max_count)]
+
+
+def createPipeline(config):
+    """Builds a Pipeline from a deployment config
+
+    Arguments:
+        config {dict} -- {'mode': 'inline'|'threads'|'processes',
+                          'serial_ports': [<str>],
+                          'controllers': [<str>],          (optional, the controller on each serial port,
+                                                            default controller01, controller02, ... in port order)
+                          'audio_config': <dict>,          (see audio_controller_worker)
+                          'debounce_seconds': <float>,     (optional, 0 turns debouncing off)
+                          'trace_sample_every': <int>,     (optional)
+                          'log_level': <str>,              (optional, for the MessageMapper)
+                          'event_store_path': <str>,       (optional, columnar log of every event, see eventstore.py)
+                          'ingress_realtime': [<dict>],    (optional, real-time config per serial port, see realtime.py)
+                          'fanout': {'destinations': [(<host>, <port>)],
+                                     'zone_map': {<sound>: <zone>},
+                                     'ttl': <int>}}        (optional, also send every command to the networked audio nodes, see fanout.py)
+
+    The AudioController's real-time config goes in audio_config['realtime']
+
+    Returns:
+        {Pipeline} -- The pipeline, ready to run()
+    """
+    front_stages = [ParseStage(config.get('trace_sample_every', 0))]
+    debounce_seconds = config.get('debounce_seconds', 0.02)
+    if debounce_seconds:
+        front_stages.append(DebounceStage(debounce_seconds))
+
+    message_mapper = MessageMapper(log_level=config.get('log_level', logging.WARNING))
+
+    event_store = None
+    if config.get('event_store_path'):
+        event_store = EventStore(config['event_store_path'])
+
+    router_stages = [MapStage(message_mapper, event_store), ValidateStage()]
+    fanout = config.get('fanout')
+    if fanout is not None:
+        destinations = [tuple(destination) for destination in fanout.get('destinations', [])]
+        router_stages.append(PublishStage(destinations or None, fanout.get('zone_map'), fanout.get('ttl', 1)))
+
+    controllers = config.get('controllers') or ['controller%02d' % (i + 1) for i in range(len(config['serial_ports']))]
+    return Pipeline([SerialSource(port_path, controller=controller)
+                     for port_path, controller in zip(config['serial_ports'], controllers)],
+                    config['audio_config'],
+                    mode=config.get('mode', PROCESSES),
+                    front_stages=front_stages,
+                    ingress_realtime=config.get('ingress_realtime'),
+                    router_stages=router_stages)
+
+
+class Pipeline(object):
+    """Runs sources -> front stages -> router stages -> AudioController in the chosen layout
+
+    example usage:
+
+    pipeline = Pipeline([SerialSource('/dev/ttyACM1'), SerialSource('/dev/ttyACM0')],
+                        audio_config, mode=INLINE)
+    pipeline.run()  # Until pipeline.stop(), or ctrl-c
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, sources, audio_config, mode=PROCESSES, front_stages=None, router_stages=None,
+                 idle_sleep=0.001, ingress_realtime=None):
+        """Initialize the Pipeline.  Nothing is started until run()
+
+        Arguments:
+            sources {list} -- Sources to read from, e.g. SerialSource('/dev/ttyACM0')
+            audio_config {dict} -- AudioController config
+
+        Keyword Arguments:
+            mode {str} -- INLINE, THREADS or PROCESSES (default: {PROCESSES})
+            front_stages {list} -- Stages run per source.  Each source gets its own copy (default: {[ParseStage(), DebounceStage()]})
+            router_stages {list} -- Stages run on the router (default: {[MapStage(), ValidateStage()]})
+            idle_sleep {float} -- Seconds the router sleeps when a pass found nothing to do (default: {0.001})
+            ingress_realtime {list} -- Real-time config for each source's worker, see realtime.py (default: {None})
+        """
+        if mode not in MODES:
+            raise ValueError('Unknown pipeline mode [%s]' % mode)
+        if front_stages is None:
+            front_stages = [ParseStage(), DebounceStage()]
+        if router_stages is None:
+            router_stages = [MapStage(), ValidateStage()]
+
+        self.mode = mode
+        self._sources = sources
+        self._audio_config = audio_config
+        self._front_stages = [copy.deepcopy(front_stages) for _ in sources]
+        self._idle_sleep = idle_sleep
+        self._ingress_realtime = ingress_realtime or [None] * len(sources)
+
+        self._stop_event = multiprocessing.Event()
+
+        if mode == PROCESSES:
+            self._command_queues = [multiprocessing.Queue() for _ in sources]
+        else:
+            self._command_queues = [Queue.Queue() for _ in sources]
+
+        if mode == INLINE:
+            # Commands are handled right after they are routed, so the queue never holds more than a few
+            self._event_queues = []
+            self._audio_queue = _InlineQueue()
+        else:
+            self._event_queues = [PriorityLaneQueue(classifyEventMessage, EVENT_LANES) for _ in sources]
+            self._audio_queue = PriorityLaneQueue(classifyAudioCommand)
+
+        self._dispatch = DispatchStage(self._audio_queue)
+        self._router_stages = list(router_stages) + [self._dispatch]
+        self._context = StageContext(self._command_queues,
+                                     dict((getattr(source, 'controller', None), command_queue)
+                                          for source, command_queue in zip(sources, self._command_queues)
+                                          if getattr(source, 'controller', None) is not None))
+
+        self._audio_controller = None
+        self._threads = []
+        self._supervisor = None
+
+    def _start(self):
+        for stage in self._router_stages:
+            stage.open(self._context)
+
+        if self.mode == INLINE:
+            for source, stages, command_queue in zip(self._sources, self._front_stages, self._command_queues):
+                source.open(command_queue)
+                for stage in stages:
+                    stage.open(self._context)
+            # Everything runs on this thread, so it gets the AudioController's settings.  They
+            # are applied before the mixer starts, so that its audio thread inherits them too
+            realtime = self._audio_config.get('realtime')
+            scheduling = None
+            if realtime:
+                scheduling = applyScheduling(realtime, 'pipeline')
+            self._audio_controller = AudioController(self._audio_config, [self._audio_queue])
+            if realtime:
+                enterRealtime(realtime, 'pipeline', scheduling)
+            return
+
+        ingress_args = [(source, stages, event_queue, command_queue, self._context, self._stop_event, realtime)
+                        for source, stages, event_queue, command_queue, realtime
+                        in zip(self._sources, self._front_stages, self._event_queues, self._command_queues,
+                               self._ingress_realtime)]
+
+        if self.mode == THREADS:
+            targets = [(audio_controller_worker, (self._audio_config, [self._audio_queue]))]
+            targets += [(ingress_worker, args) for args in ingress_args]
+            for target, args in targets:
+                thread = threading.Thread(target=target, args=args)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            return
+
+        # Workers which die or stop sending heartbeats are restarted.  The queues and the
+        # router stages live in this process, so they carry on across restarts
+        self._supervisor = Supervisor()
+        self._supervisor.addWorker('audio', audio_controller_worker, args=(self._audio_config, [self._audio_queue]))
+        for i, args in enumerate(ingress_args):
+            self._supervisor.addWorker('ingress_%02d' % (i + 1), ingress_worker, args=args)
+        self._supervisor.start()
+
+    def _pollInline(self):
+        """Runs each source's chain and the AudioController once.  Returns True if anything arrived"""
+        busy = False
+        for source, stages in zip(self._sources, self._front_stages):
+            for message in source.poll(0):
+                busy = True
+                message = runStages(stages, message)
+                if message is not None:
+                    runStages(self._router_stages, message)
+        # DispatchStage buffers commands for queues which take batches, this one included
+        self._dispatch.flush()
+        self._audio_controller.processPendingMessages()
+        return busy
+
+    def _pollQueues(self):
+        """Routes everything which is ready on the sources' queues, and forwards the resulting
+        commands to the AudioController as one batch.  Returns True if there was anything
+        """
+        busy = False
+        for event_queue in self._event_queues:
+            for message in event_queue.get_many():
+                busy = True
+                runStages(self._router_stages, message)
+        self._dispatch.flush()
+        return busy
+
+    def run(self):
+        """Starts the pipeline, and routes messages until stop() is called (or ctrl-c)"""
+        self._start()
+        try:
+            while not self._stop_event.is_set():
+                if self._supervisor:
+                    self._supervisor.poll()
+
+                if self.mode == INLINE:
+                    busy = self._pollInline()
+                else:
+                    busy = self._pollQueues()
+
+                if not busy:
+                    time.sleep(self._idle_sleep)
+        except KeyboardInterrupt:
+            self._logger.info('Interrupted, stopping the pipeline')
+        finally:
+            self._shutdown()
+
+    def stop(self):
+        """Makes run() shut the pipeline down and return.  Safe to call from any thread or a signal handler"""
+        self._stop_event.set()
+
+    def _shutdown(self):
+        self._stop_event.set()
+        self._dispatch.flush()
+        self._audio_queue.put(END_THREAD)
+
+        if self.mode == INLINE and self._audio_controller is not None:
+            # Play out whatever was still queued, up to the END_THREAD
+            while self._audio_controller.processPendingMessages():
+                pass
+            for source, stages in zip(self._sources, self._front_stages):
+                for stage in stages:
+                    stage.close()
+                source.close()
+        elif self.mode == THREADS:
+            for thread in self._threads:
+                thread.join(2.0)
+        else:
+            self._supervisor.stop()
+
+        for stage in self._router_stages:
+            stage.close()
+
+    def getSupervisorMetrics(self):
+        """Returns the Supervisor's worker metrics in PROCESSES mode, an empty dict otherwise"""
+        if self._supervisor is None:
+            return {}
+        return self._supervisor.getMetrics()
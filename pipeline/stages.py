@@ -0,0 +1,335 @@
+"""Building blocks of a Pipeline:  Sources, which produce raw messages, and Stages, which
+transform them one at a time
+
+    SerialSource -> ParseStage -> DebounceStage -> MapStage -> ValidateStage -> [PublishStage] -> DispatchStage
+    (ingress)       (parse)       (debounce)       (map)       (validate)       (fan out)         (dispatch)
+
+A Stage's process() returns the message to hand on to the next stage, or None to drop it.
+Stages are plain picklable objects until open() is called, so they can be built in the
+parent and sent to whichever thread or process runs them.
+"""
+
+import collections
+import logging
+import Queue
+import time
+
+from fanout import AudioCommandPublisher
+from messages import EventMessage
+from tracing import Tracer
+
+from audiocontroller.audiocontroller import AudioController
+from serialprocessor.messagemapper import MessageMapper
+from serialprocessor.panelstate import INDICATOR_CONTROLLERS
+from serialprocessor.serialprocessor import SerialProcessor
+
+
+# What open() gets, for stages which drive the panel's LEDs:  The command queue of every source,
+# and of every source which knows the name of its controller, by that name
+StageContext = collections.namedtuple('StageContext', ['command_queues', 'controller_queues'])
+
+
+class Source(object):
+    """Produces the raw messages which enter a pipeline"""
+
+    # Name of the controller behind the source (e.g. 'controller01'), if it is known
+    controller = None
+
+    def open(self, command_queue=None):
+        """Opens the source.  Called in the thread/process which polls it
+
+        Keyword Arguments:
+            command_queue {queue} -- Commands ({'component', 'value'}) for the device behind the source (default: {None})
+        """
+        pass
+
+    def poll(self, timeout):
+        """Returns the messages which arrived, waiting up to timeout seconds for the first one
+
+        Arguments:
+            timeout {float} -- Seconds to wait, 0 to return right away
+
+        Returns:
+            {list} -- Raw messages (possibly none)
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class Stage(object):
+    """One step of a pipeline.  The base class passes messages through unchanged"""
+
+    def open(self, context):
+        """Called once, in the thread/process which runs the stage
+
+        Arguments:
+            context {StageContext} -- The pipeline's queues
+        """
+        pass
+
+    def process(self, message):
+        """Returns the message for the next stage, or None to drop it"""
+        return message
+
+    def close(self):
+        pass
+
+
+def runStages(stages, message):
+    """Passes a message through the stages, in order, stopping if one of them drops it
+
+    Returns:
+        {object} -- What the last stage returned, or None if the message was dropped
+    """
+    for stage in stages:
+        message = stage.process(message)
+        if message is None:
+            return None
+    return message
+
+
+class SerialSource(Source):
+    """Reads lines from a microcontroller's serial port, without ever blocking longer than poll's timeout
+
+    The port is driven by a SerialProcessor, the same as in the serial_processor_worker, but
+    polled from the calling thread instead of through startSerialListening:  So it needs no
+    threads of its own, and its outbound work (a frame of commands for the controller,
+    samples of the encoders and pots) is done on every poll
+    """
+
+    def __init__(self, port_path, baud=19200, frame_interval=0.05, sample_interval=0.05, controller=None):
+        """Initialize the SerialSource.  The port isn't opened until open()
+
+        Arguments:
+            port_path {str} -- Path to the serial port, e.g. '/dev/ttyACM0'
+
+        Keyword Arguments:
+            baud {int} -- Connection speed (default: {19200})
+            frame_interval {float} -- Seconds between batched writes to the controller (default: {0.05})
+            sample_interval {float} -- Seconds between samples of the encoders and pots (default: {0.05})
+            controller {str} -- Name of the controller on the port, e.g. 'controller01' (default: {None})
+        """
+        self.port_path = port_path
+        self.controller = controller
+        self._baud = baud
+        self._frame_interval = frame_interval
+        self._sample_interval = sample_interval
+
+        self.serialProcessor = None
+
+    def open(self, command_queue=None):
+        # Lines are parsed by the ParseStage, so only the aggregated encoder/pot events go on this queue
+        self._continuous_events = Queue.Queue()
+        self.serialProcessor = SerialProcessor({'port_path': self.port_path}, self._continuous_events,
+                                               controller_baud=self._baud,
+                                               log_level=logging.getLogger().getEffectiveLevel(),
+                                               read_timeout=0,
+                                               command_queue=command_queue,
+                                               frame_interval=self._frame_interval,
+                                               sample_interval=self._sample_interval)
+        self.serialProcessor.requestStateDump()
+
+    def poll(self, timeout):
+        self.serialProcessor.setReadTimeout(timeout)
+        messages = self.serialProcessor.readLines()
+        self.serialProcessor.service()
+        while not self._continuous_events.empty():
+            messages.append(self._continuous_events.get_nowait())
+        return messages
+
+    def close(self):
+        if self.serialProcessor is not None:
+            self.serialProcessor.close()
+            self.serialProcessor = None
+
+
+class IterableSource(Source):
+    """Source which replays a list of lines (or EventMessages), for tests and benchmarks"""
+
+    def __init__(self, messages):
+        self._messages = collections.deque(messages)
+
+    def poll(self, timeout):
+        if not self._messages:
+            if timeout:
+                time.sleep(timeout)
+            return []
+        return [self._messages.popleft()]
+
+
+class ParseStage(Stage):
+    """Decodes a json line from a microcontroller into an EventMessage, with
+    SerialProcessor.processJson.  EventMessages pass through
+    """
+
+    def __init__(self, trace_sample_every=0):
+        """Initialize the ParseStage
+
+        Keyword Arguments:
+            trace_sample_every {int} -- Trace every n'th event through the pipeline, 0 for no tracing (default: {0})
+        """
+        self._tracer = Tracer(trace_sample_every)
+
+    def process(self, line):
+        if isinstance(line, EventMessage):
+            return line
+
+        trace = None
+        if self._tracer.enabled:
+            trace = self._tracer.begin(time.time())
+        return SerialProcessor.processJson('ingress', line, trace)
+
+
+class DebounceStage(Stage):
+    """Drops an event which repeats the component's last value within the debounce window
+
+    Switch bounce shows up as the same value reported twice in quick succession;  a real
+    change of value is always passed on, however quickly it follows the last one
+    """
+
+    def __init__(self, window=0.02):
+        """Initialize the DebounceStage
+
+        Keyword Arguments:
+            window {float} -- Seconds within which a repeated value is dropped (default: {0.02})
+        """
+        self._window = window
+        self._last = {}
+        self.droppedCount = 0
+
+    def process(self, event_message):
+        now = time.time()
+        key = (event_message.component, event_message.action)
+        last = self._last.get(key)
+        self._last[key] = (event_message.value, now)
+        if last is not None and last[0] == event_message.value and now - last[1] < self._window:
+            self.droppedCount += 1
+            return None
+        return event_message
+
+
+class MapStage(Stage):
+    """Maps events to AudioCommands, and keeps the panel's indicators in step with the panel state"""
+
+    _logger = logging.getLogger()
+
+    def __init__(self, message_mapper=None, event_store=None):
+        """Initialize the MapStage
+
+        Keyword Arguments:
+            message_mapper {MessageMapper} -- Mapper to use.  A new one is made if None (default: {None})
+            event_store {EventStore} -- Log of every event and the command it produced (default: {None})
+        """
+        if message_mapper is None:
+            message_mapper = MessageMapper()
+        self.messageMapper = message_mapper
+        self._event_store = event_store
+        self._command_queues = []
+        self._controller_queues = {}
+        self._panel_status = None
+
+    def open(self, context):
+        self._command_queues = context.command_queues
+        self._controller_queues = context.controller_queues
+
+    def process(self, event_message):
+        if event_message.trace is not None:
+            event_message.trace.stamp('queue_to_router')
+
+        start = time.time()
+        audio_command = self.messageMapper.getAudiocontrollerMessageForEvent(event_message)
+        if self._event_store is not None:
+            self._event_store.record(event_message, audio_command, time.time() - start)
+
+        panel_state = self.messageMapper.panelState
+        if panel_state.panelActiveStatus != self._panel_status:
+            self._panel_status = panel_state.panelActiveStatus
+            for command in panel_state.getIndicatorCommands():
+                # Each controller only gets the indicators it drives:  The serial links are slow
+                command_queue = self._controller_queues.get(INDICATOR_CONTROLLERS.get(command['component']))
+                if command_queue is not None:
+                    command_queue.put(command)
+                    continue
+                for command_queue in self._command_queues:
+                    command_queue.put(command)
+
+        return audio_command
+
+    def close(self):
+        if self._event_store is not None:
+            self._event_store.close()
+
+
+class ValidateStage(Stage):
+    """Drops anything the AudioController couldn't play"""
+
+    _logger = logging.getLogger()
+
+    def process(self, audio_command):
+        if not AudioController.isValidAudioCommand(audio_command):
+            self._logger.error('Audio command [%s] invalid' % (audio_command,))
+            return None
+        return audio_command
+
+
+class PublishStage(Stage):
+    """Sends every AudioCommand to the networked audio nodes (see fanout.py), and passes it on
+    to the local AudioController too
+    """
+
+    def __init__(self, destinations=None, zone_map=None, ttl=1):
+        """Initialize the PublishStage.  The socket isn't opened until open()
+
+        Keyword Arguments:
+            destinations {list} -- (host, port) tuples:  Multicast groups and/or node addresses (default: {[fanout.DEFAULT_GROUP]})
+            zone_map {dict} -- Sound name to zone.  Sounds which aren't in it go to every zone (default: {None})
+            ttl {int} -- Multicast time to live (default: {1})
+        """
+        self._destinations = destinations
+        self._zone_map = zone_map
+        self._ttl = ttl
+        self.publisher = None
+
+    def open(self, context):
+        self.publisher = AudioCommandPublisher(self._destinations, self._zone_map, self._ttl)
+
+    def process(self, audio_command):
+        self.publisher.publish(audio_command)
+        return audio_command
+
+    def close(self):
+        if self.publisher is not None:
+            self.publisher.close()
+
+
+class DispatchStage(Stage):
+    """Puts messages on the queue to the next part of the pipeline.  Always returns None
+
+    If the queue has put_many, messages are held until flush(), and go out as one batch
+    """
+
+    def __init__(self, queue):
+        self._queue = queue
+        self._batch = [] if hasattr(queue, 'put_many') else None
+        self.dispatchedCount = 0
+        self.batchCount = 0
+
+    def process(self, message):
+        if self._batch is None:
+            self._queue.put(message)
+        else:
+            self._batch.append(message)
+        self.dispatchedCount += 1
+        return None
+
+    def flush(self):
+        """Sends the messages held since the last flush"""
+        if self._batch:
+            self._queue.put_many(self._batch)
+            self._batch = []
+            self.batchCount += 1
+
+    def close(self):
+        self.flush()
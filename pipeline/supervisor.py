@@ -0,0 +1,195 @@
+"""Keeps the pipeline worker processes running
+
+Each worker gets a Heartbeat, which it beats from its main loop.  The Supervisor is polled
+from the router loop, and restarts any worker which has died, or whose heartbeat has gone
+stale.  The queues are owned by the parent process, so messages which are still on a
+queue's pipes when a worker dies are there for its replacement.  Messages the dead worker
+had already taken off the pipes (a PriorityLaneQueue drains them into buffers inside the
+consumer) are lost with it.  The MessageMapper (and its PanelState) live in the router, so
+they carry on across worker restarts.
+"""
+
+import logging
+import multiprocessing
+import time
+
+
+class Heartbeat(object):
+    """Timestamp shared between a worker process and the supervisor
+
+    beat() is cheap enough to be called on every pass of a busy loop:  The shared value is
+    only written once per interval.
+    """
+
+    def __init__(self, interval=0.25):
+        self._interval = interval
+        self._value = multiprocessing.RawValue('d', 0.0)
+        self._local_last = 0.0
+
+    def beat(self):
+        now = time.time()
+        if now - self._local_last >= self._interval:
+            self._local_last = now
+            self._value.value = now
+
+    def reset(self):
+        """Clears the heartbeat, so the next beat is seen as the first one"""
+        self._local_last = 0.0
+        self._value.value = 0.0
+
+    def last(self):
+        """Returns the time of the most recent beat, or 0.0 if there hasn't been one"""
+        return self._value.value
+
+
+class _Worker(object):
+    __slots__ = ('name', 'target', 'args', 'kwargs', 'heartbeat_timeout', 'heartbeat',
+                 'process', 'started_at', 'failed_at', 'restarts', 'recovery_times')
+
+    def __init__(self, name, target, args, kwargs, heartbeat_timeout):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.heartbeat_timeout = heartbeat_timeout
+        self.heartbeat = Heartbeat()
+        self.process = None
+        self.started_at = 0.0
+        self.failed_at = None
+        self.restarts = 0
+        self.recovery_times = []
+
+
+class Supervisor(object):
+    """Starts worker processes and restarts them if they die or get stuck
+
+    Worker functions must accept a `heartbeat` keyword argument, and call heartbeat.beat()
+    from their main loop.
+
+    example usage:
+
+    supervisor = Supervisor()
+    supervisor.addWorker('audio', audio_controller_worker, args=(audio_config, [q3]))
+    supervisor.start()
+    while True:
+        supervisor.poll()
+        ...
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, heartbeat_timeout=5.0, startup_grace=30.0, poll_interval=0.5,
+                 restart_delay=1.0):
+        """Initialize the Supervisor
+
+        Keyword Arguments:
+            heartbeat_timeout {float} -- Seconds without a heartbeat before a worker counts as stuck (default: {5.0})
+            startup_grace {float} -- Seconds a new worker has to send its first heartbeat (loading sounds takes a while) (default: {30.0})
+            poll_interval {float} -- Minimum seconds between checks in poll() (default: {0.5})
+            restart_delay {float} -- Minimum seconds between restarts of the same worker (default: {1.0})
+        """
+        self._heartbeat_timeout = heartbeat_timeout
+        self._startup_grace = startup_grace
+        self._poll_interval = poll_interval
+        self._restart_delay = restart_delay
+
+        self._workers = []
+        self._last_poll = 0.0
+
+    def addWorker(self, name, target, args=(), kwargs=None, heartbeat_timeout=None):
+        """Registers a worker.  It is started by start()
+
+        Arguments:
+            name {str} -- Name used in logs and metrics
+            target {function} -- Worker function, run in its own process
+
+        Keyword Arguments:
+            args {tuple} -- Positional arguments for target (default: {()})
+            kwargs {dict} -- Keyword arguments for target.  'heartbeat' is added (default: {None})
+            heartbeat_timeout {float} -- Overrides the supervisor wide heartbeat timeout (default: {None})
+        """
+        if heartbeat_timeout is None:
+            heartbeat_timeout = self._heartbeat_timeout
+        self._workers.append(_Worker(name, target, args, dict(kwargs or {}), heartbeat_timeout))
+
+    def _startWorker(self, worker):
+        worker.heartbeat.reset()
+        kwargs = dict(worker.kwargs)
+        kwargs['heartbeat'] = worker.heartbeat
+        worker.process = multiprocessing.Process(target=worker.target, name=worker.name,
+                                                 args=worker.args, kwargs=kwargs)
+        worker.process.daemon = True
+        worker.process.start()
+        worker.started_at = time.time()
+        self._logger.info('Started worker %s (pid %s)' % (worker.name, worker.process.pid))
+
+    def start(self):
+        for worker in self._workers:
+            self._startWorker(worker)
+
+    def _checkWorker(self, worker, now):
+        last_beat = worker.heartbeat.last()
+
+        if worker.failed_at is not None and last_beat >= worker.started_at:
+            # First heartbeat from the replacement:  The worker has recovered
+            recovery_time = last_beat - worker.failed_at
+            worker.recovery_times.append(recovery_time)
+            worker.failed_at = None
+            self._logger.warning('Worker %s recovered in %.2fs' % (worker.name, recovery_time))
+
+        if not worker.process.is_alive():
+            reason = 'exited with code %s' % worker.process.exitcode
+        elif last_beat == 0.0 and now - worker.started_at > self._startup_grace:
+            reason = 'never sent a heartbeat'
+        elif last_beat != 0.0 and now - last_beat > worker.heartbeat_timeout:
+            reason = 'heartbeat is %.1fs old' % (now - last_beat)
+        else:
+            return
+
+        if now - worker.started_at < self._restart_delay:
+            return  # Don't spin on a worker which dies right away (e.g. a missing port)
+
+        self._logger.error('Worker %s %s, restarting it' % (worker.name, reason))
+        if worker.failed_at is None:
+            worker.failed_at = now
+
+        if worker.process.is_alive():
+            # Note:  A process terminated while holding a queue lock can leave that queue
+            # unusable, which is why only stuck workers are terminated
+            worker.process.terminate()
+        worker.process.join(1.0)
+
+        worker.restarts += 1
+        self._startWorker(worker)
+
+    def poll(self):
+        """Checks on the workers, restarting any which are dead or stuck.  Call this regularly;
+        it returns right away if it was called less than poll_interval ago
+        """
+        now = time.time()
+        if now - self._last_poll < self._poll_interval:
+            return
+        self._last_poll = now
+
+        for worker in self._workers:
+            self._checkWorker(worker, now)
+
+    def stop(self, timeout=2.0):
+        """Waits for the workers to exit (after they were sent their end_thread messages),
+        terminating any which are still running after timeout
+        """
+        for worker in self._workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    def getMetrics(self):
+        """Returns a dictionary of worker name to {'restarts': <int>, 'recovery_times': [<float>], 'alive': <bool>}"""
+        metrics = {}
+        for worker in self._workers:
+            metrics[worker.name] = {
+                'restarts': worker.restarts,
+                'recovery_times': list(worker.recovery_times),
+                'alive': worker.process is not None and worker.process.is_alive()
+            }
+        return metrics
@@ -0,0 +1,134 @@
+"""Per-event tracing through the pipeline, exported as Chrome/Perfetto trace-event json
+
+A sampled event gets a Trace when it is read off the serial line.  The Trace rides along on
+the EventMessage, and then on the AudioCommand the MessageMapper makes for it, and every
+stage boundary stamps it.  When the command reaches the AudioController the trace is
+written out, with one span per stage:
+
+    serial_read -> parse -> queue_to_router -> map -> queue_to_audio -> mixer
+
+Load the file in chrome://tracing or https://ui.perfetto.dev.  Events which aren't sampled
+carry trace=None, so with tracing off the cost is a single 'is not None' check per stage.
+"""
+
+import json
+import logging
+import os
+import time
+
+
+class Trace(object):
+    """Timestamps for one event, as (stage, time, pid) tuples.  The first stamp is the ingress"""
+
+    __slots__ = ('trace_id', 'stamps')
+
+    def __init__(self, trace_id, ingress_time):
+        self.trace_id = trace_id
+        self.stamps = [('serial_read', ingress_time, os.getpid())]
+
+    def stamp(self, stage):
+        """Marks the end of a stage
+
+        Arguments:
+            stage {str} -- Name of the stage which just finished
+        """
+        self.stamps.append((stage, time.time(), os.getpid()))
+
+
+class Tracer(object):
+    """Decides which events are traced:  Every sample_every'th one, or none if sample_every is 0
+
+    example usage:
+
+    tracer = Tracer(sample_every=100)
+    trace = None
+    if tracer.enabled:
+        trace = tracer.begin(time.time())
+    if trace is not None:
+        trace.stamp('parse')
+    """
+
+    def __init__(self, sample_every=0):
+        self._sample_every = sample_every
+        self._count = 0
+
+        # False when nothing is sampled, so callers can skip taking the ingress time
+        self.enabled = bool(sample_every)
+
+    def begin(self, ingress_time):
+        """Returns a new Trace if this event is sampled, None else
+
+        Arguments:
+            ingress_time {float} -- Time the event was read
+        """
+        if not self._sample_every:
+            return None
+        self._count += 1
+        if self._count % self._sample_every:
+            return None
+        # Unique across the serial processes, and an int, since Chrome uses it as a thread id
+        return Trace(os.getpid() * 1000000 + self._count // self._sample_every % 1000000, ingress_time)
+
+
+class ChromeTraceWriter(object):
+    """Appends finished traces to a Chrome trace-event json file
+
+    The file is a json array which is never closed, which the trace viewers accept, so it is
+    readable even while the pipeline is still running (or after it crashed).  An existing
+    file is appended to, so a worker which the supervisor restarts carries on with the trace
+    rather than truncating it.
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, trace_path):
+        size = 0
+        if os.path.exists(trace_path):
+            size = ChromeTraceWriter._dropPartialLine(trace_path)
+        self._file = open(trace_path, 'a')
+        if size == 0:
+            self._file.write('[\n')
+        self.tracesWritten = 0
+
+    @staticmethod
+    def _dropPartialLine(trace_path):
+        """Cuts off the end of a line a worker didn't finish writing (e.g. it was killed), so
+        the events after it are still json.  Returns the size of what is left"""
+        with open(trace_path, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            # Each line holds one event, which is far shorter than this
+            f.seek(max(0, size - 65536))
+            tail = f.read()
+            end = size - len(tail) + tail.rfind(b'\n') + 1
+            if end < size:
+                f.truncate(end)
+                ChromeTraceWriter._logger.warning('Dropped a partly written event from %s' % trace_path)
+            return end
+
+    def write(self, trace):
+        """Writes one span per stage of the trace
+
+        Arguments:
+            trace {Trace} -- Finished trace
+        """
+        events = []
+        previous_time = trace.stamps[0][1]
+        for stage, stamp_time, pid in trace.stamps[1:]:
+            events.append({'name': stage,
+                           'cat': 'pipeline',
+                           'ph': 'X',
+                           'ts': previous_time * 1000000.0,
+                           'dur': (stamp_time - previous_time) * 1000000.0,
+                           'pid': pid,
+                           'tid': trace.trace_id,
+                           'args': {'trace_id': trace.trace_id}})
+            previous_time = stamp_time
+
+        for event in events:
+            self._file.write(json.dumps(event) + ',\n')
+        self._file.flush()
+        self.tracesWritten += 1
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,86 @@
+"""Local loopback test of audio command fan-out
+
+Starts several headless audio nodes (AudioController + NullBackend), each subscribed to
+a zone on its own loopback port, publishes a burst of commands to all of them, and
+prints each node's received/dropped counts and publish to receive latency.
+
+    PYTHONPATH=. python pipeline_test/fanout_test.py --nodes 4 --commands 5000
+"""
+
+from multiprocessing import Process, Queue
+from audiocontroller.audiocontroller import AudioController
+from pipeline.fanout import AudioCommandPublisher, AudioCommandSubscriber
+from pipeline.messages import AudioCommand, END_THREAD
+
+import sys
+import time
+import logging
+import argparse
+
+
+logging.basicConfig(format='%(filename)s.%(lineno)d:%(levelname)s:%(message)s',
+                    level=logging.WARNING)
+
+audio_config = {
+    'audio_file_list': [
+            {'name': 'blip_low',        'loopable': False},
+            {'name': 'blip_medium',     'loopable': False},
+            {'name': 'heat_warning',    'loopable': True}
+            ],
+    'default_audio_path': 'audio_files',
+    'backend': 'null'
+ }
+
+BASE_PORT = 5100
+
+
+def node_worker(zone, port, result_queue):
+    subscriber = AudioCommandSubscriber([zone], address=('127.0.0.1', port))
+    ac = AudioController(audio_config, [subscriber])
+    ac.consumeMessages()
+    result_queue.put((zone, port, subscriber.getStats()))
+
+
+def parse_arguments(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--nodes", dest="nodes", type=int, default=4,
+                        help="Number of audio nodes")
+    parser.add_argument("-c", "--commands", dest="commands", type=int, default=5000,
+                        help="Number of commands to publish")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+
+    results = Queue()
+    nodes = []
+    for i in range(args.nodes):
+        zone = 'zone%d' % (i % 2)
+        node = Process(target=node_worker, args=(zone, BASE_PORT + i, results))
+        node.start()
+        nodes.append(node)
+
+    time.sleep(1)  # Let the nodes load their sounds and bind
+
+    publisher = AudioCommandPublisher([('127.0.0.1', BASE_PORT + i) for i in range(args.nodes)])
+    commands = [AudioCommand('play', 'blip_low'), AudioCommand('play', 'blip_medium')]
+
+    start = time.time()
+    for n in range(args.commands):
+        publisher.publish(commands[n % 2], zone='zone%d' % (n % 2))
+    elapsed = time.time() - start
+
+    time.sleep(0.5)
+    publisher.publish(END_THREAD)
+
+    print("Published %d commands to %d nodes in %.3fs (%.0f commands/s), %d dropped"
+          % (args.commands, args.nodes, elapsed, args.commands / elapsed, publisher.dropCount))
+    for _ in nodes:
+        zone, port, stats = results.get(timeout=10)
+        print("Node %s on %d: %s" % (zone, port, stats))
+
+    for node in nodes:
+        node.join()
@@ -0,0 +1,64 @@
+"""Checks that a batch keeps its order across the PriorityLaneQueue's lanes, so that a one-shot
+play (cosmetic lane) and the stop which follows it (control lane) cancel out in the
+AudioController, rather than the stop being applied first and the sound playing anyway
+
+    PYTHONPATH=. python pipeline_test/lanequeue_test.py
+"""
+
+import logging
+import time
+
+from audiocontroller.audiocontroller import AudioController
+from audiocontroller.backend import RecordingBackend
+from pipeline.lanequeue import PriorityLaneQueue, classifyAudioCommand
+from pipeline.messages import AudioCommand
+
+
+logging.basicConfig(format='%(filename)s.%(lineno)d:%(levelname)s:%(message)s',
+                    level=logging.WARNING)
+
+audio_config = {
+    'audio_file_list': [
+            {'name': 'blip_low',     'loopable': False},
+            {'name': 'heat_warning', 'loopable': True}
+            ],
+    'default_audio_path': 'audio_files'
+ }
+
+
+def readBatch(q, count):
+    """Waits for count messages to come through the pipes, and returns them with get_many"""
+    deadline = time.time() + 2.0
+    messages = []
+    while len(messages) < count and time.time() < deadline:
+        messages += q.get_many()
+        time.sleep(0.01)
+    return messages
+
+
+def test_order_across_lanes():
+    q = PriorityLaneQueue(classifyAudioCommand)
+    commands = [AudioCommand('play', 'blip_low'), AudioCommand('stop', 'blip_low'),
+                AudioCommand('play', 'heat_warning', loop=True), AudioCommand('play', 'blip_medium')]
+    q.put_many(commands)
+    assert readBatch(q, len(commands)) == commands
+
+
+def test_play_then_stop():
+    q = PriorityLaneQueue(classifyAudioCommand)
+    backend = RecordingBackend()
+    ac = AudioController(dict(audio_config, backend=backend), [q])
+
+    q.put_many([AudioCommand('play', 'blip_low'), AudioCommand('stop', 'blip_low')])
+    batch = readBatch(q, 2)
+    assert [command.action for command in batch] == ['play', 'stop'], batch
+    ac._handleBatch(batch)
+
+    actions = [call[1] for call in backend.calls]
+    assert actions == ['stop'], backend.calls
+
+
+if __name__ == '__main__':
+    for test in (test_order_across_lanes, test_play_then_stop):
+        test()
+        print('%s ok' % test.__name__)
@@ -1,7 +1,4 @@
-from multiprocessing import Process, Queue
-from serialprocessor.serialprocessor import serial_processor_worker
-from audiocontroller.audiocontroller import audio_controller_worker, AudioController
-from serialprocessor.messagemapper import MessageMapper
+from pipeline.runner import createPipeline, MODES, PROCESSES
 
 import sys
 import logging
@@ -18,6 +15,8 @@ audio_file_list = [
             {'name': 'blip_low',                'loopable': False},
             {'name': 'blip_medium',             'loopable': False},
             {'name': 'blip_high',               'loopable': False},
+            {'name': 'rotary_encoder_up',       'loopable': False},
+            {'name': 'rotary_encoder_down',     'loopable': False},
             {'name': 'artemis_online',          'loopable': False},
             {'name': 'artemis_offline',         'loopable': False},
             {'name': 'sensors_online',          'loopable': False},
@@ -61,7 +60,7 @@ audio_file_list = [
             {'name': 'ac10_gun',                'loopable': False},
             {'name': 'ams_engaged',             'loopable': False},
             {'name': 'ams_offline',             'loopable': False},
-            {'name': 'initialization_sequence', 'loopable': False},
+            {'name': 'initialization_sequence', 'loopable': False, 'stream': True},
             {'name': 'heat_warning',            'loopable': True},
             {'name': 'shutdown_sequence',       'loopable': False},
             {'name': 'satellite_established',   'loopable': False},
@@ -69,11 +68,32 @@ audio_file_list = [
             {'name': 'initiating_scan',         'loopable': False},
             {'name': 'scan_completed',          'loopable': False},
             {'name': 'shield_generator_active', 'loopable': False},
-            {'name': 'shield_generator_shutdown','loopable': False}
+            {'name': 'shield_generator_shutdown','loopable': False},
+            {'name': 'startup_sweep',           'loopable': False, 'stream': True},
+            {'name': 'all_systems_nominal',     'loopable': False}
+            ]
+
+# Cues are played and stopped by name, like any other sound.  The MessageMapper plays
+# power_up when the key turns the panel on
+cue_list = [
+            {'name': 'power_up', 'sounds': [
+                {'name': 'startup_sweep',           'offset': 0.0},
+                {'name': 'power_restored',          'offset': 0.0},
+                {'name': 'initialization_sequence', 'offset': 3.0},
+                {'name': 'all_systems_nominal',     'offset': 10.2}]}
+            ]
+
+# Phrases are rendered from their fragments into one sound, and played by name.  The
+# MessageMapper plays scan_completed_shield_active when switch-23 turns on
+phrase_list = [
+            {'name': 'scan_completed_shield_active', 'fragments': ['scan_completed', 'shield_generator_active'],
+             'gap': 0.15, 'prerender': True}
             ]
 
 audio_config = { 
     'audio_file_list': audio_file_list,
+    'cue_list': cue_list,
+    'phrase_list': phrase_list,
     'default_audio_path': 'audio_files'
  }
 
@@ -83,6 +103,18 @@ def parse_arguments(argv):
     parser.add_argument("-l", "--log", dest="log_level", 
                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], 
                         default='INFO', help="Set the logging level")
+    parser.add_argument("-m", "--mode", dest="mode", choices=MODES, default=PROCESSES,
+                        help="Pipeline layout:  Everything on one thread, or spread over threads or processes")
+    parser.add_argument("-t", "--trace-every", dest="trace_every", type=int, default=0,
+                        help="Trace every n'th event through the pipeline (0 is off)")
+    parser.add_argument("-e", "--event-log", dest="event_log", default=None,
+                        help="Columnar log of every event (see pipeline/eventstore.py)")
+    parser.add_argument("-r", "--realtime", dest="realtime", action="store_true",
+                        help="Pin the workers to their own cores with real-time priority (Pi 4 layout)")
+    parser.add_argument("--trace-path", dest="trace_path", default="pipeline_trace.json",
+                        help="Chrome trace-event json file for the traced events")
+    parser.add_argument("-f", "--fanout", dest="fanout", action="append", default=None, metavar="HOST:PORT",
+                        help="Also send every audio command to this multicast group or audio node (repeatable)")
 
     return parser.parse_args(argv)
 
@@ -92,46 +124,29 @@ if __name__ == '__main__':
     print("Starting multiprocess app")
 
     args = parse_arguments(sys.argv[1:])
-    log_level = args.log_level
-
-    q1 = Queue()
-    q2 = Queue()
-    q3 = Queue()
-
-    message_mapper = MessageMapper(log_level=log_level)
-    
-    audio_process = Process( target=audio_controller_worker, args=(audio_config, [q3],))
-    audio_process.start()
-
-    serial_process_01 = Process( target = serial_processor_worker, args=('/dev/ttyACM1', q1,))
-    serial_process_01.start()
-
-    serial_process_02 = Process( target = serial_processor_worker, args=('/dev/ttyACM0', q2,))
-    serial_process_02.start()
-
-
-    while True:
-        for q in [q1, q2]:
-            if not q.empty():
-                event_message = q.get(block=False, timeout=0.01)
-                if not event_message:
-                    continue
-                
-                logging.debug("event_message is: %s" % event_message)
-                audio_command = message_mapper.getAudiocontrollerMessageForEvent(event_message)
-                logging.debug("audio_command is: %s" % audio_command)
-
-                # If the message mapper didn't return a message for the audio controller, continue loop
-                if not audio_command:
-                    continue
-
-                if not AudioController.isValidAudioCommand(audio_command):
-                    logging.error("Audio command [%s] invalid" % audio_command)
-                    continue
-
-                q3.put(audio_command)
-    
 
-    audio_process.join()
-    serial_process_01.join()
-    serial_process_02.join()
+    if args.trace_every:
+        audio_config['trace_path'] = args.trace_path
+
+    # Core 0 is left to the router and the OS.  Without privileges this falls back to a warning
+    ingress_realtime = None
+    if args.realtime:
+        audio_config['realtime'] = {'cpu': 3, 'policy': 'fifo', 'priority': 60, 'lock_memory': True}
+        ingress_realtime = [{'cpu': 1, 'policy': 'fifo', 'priority': 50},
+                            {'cpu': 2, 'policy': 'fifo', 'priority': 50}]
+
+    fanout = None
+    if args.fanout:
+        fanout = {'destinations': [(host, int(port)) for host, port in
+                                   (destination.rsplit(':', 1) for destination in args.fanout)]}
+
+    # The layout is picked per board:  'inline' on a single core, 'processes' on a Pi 4
+    pipeline = createPipeline({'mode': args.mode,
+                               'serial_ports': ['/dev/ttyACM1', '/dev/ttyACM0'],
+                               'audio_config': audio_config,
+                               'trace_sample_every': args.trace_every,
+                               'log_level': args.log_level,
+                               'event_store_path': args.event_log,
+                               'ingress_realtime': ingress_realtime,
+                               'fanout': fanout})
+    pipeline.run()
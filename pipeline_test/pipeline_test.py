@@ -1,6 +1,7 @@
-from audiocontroller.audiocontroller import audio_queue
 from audiocontroller.audiocontroller import audio_controller_worker
 from serialprocessor.serialprocessor import SerialProcessor
+from pipeline.lanequeue import PriorityLaneQueue, classifyAudioCommand
+from pipeline.messages import END_THREAD
 import threading
 import time
 import logging
@@ -12,6 +13,9 @@ logging.basicConfig(format='%(filename)s.%(lineno)d:%(levelname)s:%(message)s',
 #serial_config = {'port_paths': ['/dev/ttyUSB0']}
 serial_config = {'port_paths': ['/dev/ttyACM0', '/dev/ttyACM1']}
 
+# This is the queue into which we publish sound request events
+audio_queue = PriorityLaneQueue(classifyAudioCommand)
+
 
 audio_config = [
             {'name': 'reactor_online', 'sound': 'audio_files/reactor_online.wav',
@@ -42,4 +46,4 @@ try:
 except (KeyboardInterrupt, SystemExit):
     sp.killall()
     time.sleep(1)
-    audio_queue.put({'action': 'end_thread'})
+    audio_queue.put(END_THREAD)
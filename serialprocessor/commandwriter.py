@@ -0,0 +1,165 @@
+"""Outbound path to a microcontroller:  Drives LEDs and displays on the panel
+
+Commands are coalesced per component, so only the latest value for each component is
+sent, and everything which changed during a frame goes out as a single write.  At 19200
+baud the bytes on the wire are what matters, so values which the controller already has
+are not sent again.  Writes happen on their own thread, so they never hold up reading.
+"""
+
+import json
+import logging
+import Queue
+import threading
+import time
+
+
+class CommandWriter(object):
+    """Coalesces component commands and writes them to a serial port once per frame
+
+    Each frame is written as one line:
+
+    {"action":"set","values":{"ledbar-01":"7","display-01":"1234"}}
+
+    example usage:
+
+    writer = CommandWriter(serial_port)
+    writer.start()
+    writer.setComponent('ledbar-01', '7')
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, serial_port, frame_interval=0.05, command_queue=None):
+        """Initialize the CommandWriter
+
+        Arguments:
+            serial_port {serial.Serial} -- Open port to write to (it is shared with the reader)
+
+        Keyword Arguments:
+            frame_interval {float} -- Seconds between batched writes (default: {0.05})
+            command_queue {multiprocessing.Queue} -- Queue of {'component': <str>, 'value': <str>} commands from the host (default: {None})
+        """
+        self._serial_port = serial_port
+        self._frame_interval = frame_interval
+        self._command_queue = command_queue
+
+        self._lock = threading.Lock()
+        self._pending = {}
+
+        # Keeps frames and one-off messages from interleaving on the wire
+        self._write_lock = threading.Lock()
+
+        # What the controller was last sent, so unchanged values aren't sent again
+        self._sent = {}
+
+        self._thread = None
+        self._running = False
+
+        self.bytesWritten = 0
+        self.framesWritten = 0
+        self.commandsCoalesced = 0
+
+    def setComponent(self, component, value):
+        """Queues a value for a component.  Only the latest value in a frame is sent
+
+        Arguments:
+            component {str} -- Component name, e.g. 'ledbar-01'
+            value {str} -- Value for the component
+        """
+        with self._lock:
+            if component in self._pending:
+                self.commandsCoalesced += 1
+            self._pending[component] = value
+
+    def _drainCommandQueue(self):
+        if self._command_queue is None:
+            return
+        while True:
+            try:
+                command = self._command_queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                self.setComponent(command['component'], command['value'])
+            except (KeyError, TypeError):
+                self._logger.error('Improperly structured controller command: %s' % (command,))
+
+    def _takeFrame(self):
+        """Returns the values which changed since the last frame, and clears the pending set"""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+
+        changed = {}
+        for component, value in pending.items():
+            if self._sent.get(component) != value:
+                changed[component] = value
+        return changed
+
+    def flush(self):
+        """Writes anything pending as one batch.  Called once per frame by the writer thread
+        """
+        self._drainCommandQueue()
+        changed = self._takeFrame()
+        if not changed:
+            return
+
+        line = json.dumps({'action': 'set', 'values': changed}, separators=(',', ':')) + '\n'
+        try:
+            with self._write_lock:
+                self._serial_port.write(line.encode('utf-8'))
+        except Exception as err:
+            self._logger.error('Failed writing to controller: %s' % err)
+            return
+
+        self._sent.update(changed)
+        self.bytesWritten += len(line)
+        self.framesWritten += 1
+
+    def write(self, message):
+        """Writes a single message right away, outside of the frame batching
+
+        Arguments:
+            message {dict} -- Message to send as one json line
+        """
+        line = json.dumps(message, separators=(',', ':')) + '\n'
+        with self._write_lock:
+            self._serial_port.write(line.encode('utf-8'))
+        self.bytesWritten += len(line)
+
+    def requestStateDump(self):
+        """Asks the controller for a 'statedump' message with the position of every component
+
+        Called whenever the port (re)opens.  The controller may have been reset, so every
+        value is sent again in the next frame
+        """
+        with self._lock:
+            for component, value in self._sent.items():
+                self._pending.setdefault(component, value)
+            self._sent = {}
+        self.write({'action': 'statedump_request'})
+
+    def _run(self):
+        next_frame = time.time()
+        while self._running:
+            self.flush()
+            next_frame += self._frame_interval
+            delay = next_frame - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_frame = time.time()  # We fell behind; don't try to catch up with a burst
+
+    def start(self):
+        """Starts the writer thread"""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='command_writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the writer thread, after one last flush"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
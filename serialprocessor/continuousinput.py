@@ -0,0 +1,147 @@
+"""High-rate input channel for potentiometers and rotary encoders
+
+Encoders and pots can report hundreds of readings a second, far more than the per-event
+json path (and the panel's ears) need.  They send short lines instead, which skip the json
+decoding altogether:
+
+    @encoder-01:+3      Encoder moved 3 detents up since its last report (signed delta)
+    @pot-01:512         Pot reading (absolute value, no sign)
+
+Deltas are summed and absolute readings overwritten per component, and once per sample
+interval one aggregated EventMessage per changed component goes on to the MessageMapper:
+
+    EventMessage(action='delta', component='encoder-01', value='7')
+    EventMessage(action='analog', component='pot-01', value='512')
+
+So however fast a knob is spun, it produces at most one event per sample interval.
+"""
+
+import logging
+import threading
+import time
+
+from pipeline.messages import EventMessage
+
+
+# First byte of a continuous-value line
+CONTINUOUS_MARKER = b'@'
+
+
+class ContinuousInputChannel(object):
+    """Accumulates encoder deltas and pot readings, and publishes them at a fixed rate
+
+    example usage:
+
+    channel = ContinuousInputChannel(audio_controller_queue)
+    channel.start()
+    channel.feed(b'@encoder-01:+1')
+    """
+
+    _logger = logging.getLogger()
+
+    def __init__(self, queue, sample_interval=0.05, deadband=8):
+        """Initialize the ContinuousInputChannel
+
+        Arguments:
+            queue {queue.Queue} -- Queue the aggregated EventMessages are put on
+
+        Keyword Arguments:
+            sample_interval {float} -- Seconds between samples (default: {0.05})
+            deadband {int} -- Smallest change of a pot reading which is passed on, to hide ADC noise (default: {8})
+        """
+        self._queue = queue
+        self._sample_interval = sample_interval
+        self._deadband = deadband
+
+        self._lock = threading.Lock()
+        self._deltas = {}
+        self._readings = {}
+
+        # Last pot reading which was passed on, per component
+        self._published = {}
+
+        self._thread = None
+        self._running = False
+
+        self.linesConsumed = 0
+        self.eventsPublished = 0
+
+    def feed(self, line):
+        """Adds one continuous-value line to the accumulators
+
+        Arguments:
+            line {bytes} -- Line read from the serial port, e.g. b'@encoder-01:+3'
+
+        Returns:
+            {bool} -- True if the line was a continuous-value line (valid or not), False otherwise
+        """
+        if line[:1] != CONTINUOUS_MARKER:
+            return False
+
+        try:
+            component, value = line[1:].decode('utf-8').strip().split(':', 1)
+            number = int(value)
+        except ValueError:
+            self._logger.error('Invalid continuous-value line: %r' % line)
+            return True
+
+        with self._lock:
+            if value[:1] in ('+', '-'):
+                self._deltas[component] = self._deltas.get(component, 0) + number
+            else:
+                self._readings[component] = number
+            self.linesConsumed += 1
+        return True
+
+    def _takeSample(self):
+        """Returns the events for everything which changed since the last sample"""
+        with self._lock:
+            deltas = self._deltas
+            readings = self._readings
+            self._deltas = {}
+            self._readings = {}
+
+        events = []
+        for component, delta in deltas.items():
+            # Turning back and forth within one sample cancels out
+            if delta:
+                events.append(EventMessage('delta', component, str(delta)))
+        for component, reading in readings.items():
+            published = self._published.get(component)
+            if published is None or abs(reading - published) >= self._deadband:
+                self._published[component] = reading
+                events.append(EventMessage('analog', component, str(reading)))
+        return events
+
+    def sample(self):
+        """Publishes the aggregated changes.  Called once per sample interval by the channel thread
+        """
+        for event_message in self._takeSample():
+            if self._queue is not None:
+                self._queue.put(event_message)
+            self.eventsPublished += 1
+
+    def _run(self):
+        next_sample = time.time()
+        while self._running:
+            self.sample()
+            next_sample += self._sample_interval
+            delay = next_sample - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_sample = time.time()
+
+    def start(self):
+        """Starts the sampling thread"""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='continuous_input')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the sampling thread, after publishing one last sample"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        self.sample()
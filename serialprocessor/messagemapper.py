@@ -3,6 +3,7 @@
 
 import logging
 from panelstate import PanelState, PanelActiveStatus
+from pipeline.messages import AudioCommand, EventMessage
 
 
 class MessageMapper(object):
@@ -29,6 +30,12 @@ class MessageMapper(object):
         self.__eventMap = {}
         self._configureEventMap()
 
+        # AudioCommands are immutable, so one instance per sound is made and handed out every time
+        self.__commandCache = {}
+
+        # Which third of its range each pot was last in
+        self.__analogBands = {}
+
         self.panelState = PanelState(logger, log_level)
 
 
@@ -36,15 +43,19 @@ class MessageMapper(object):
         """Given a microcontroller event, return the relevant message for the audiocontroller
         
         Arguments:
-            event_message {dict} -- Event message dictionary
+            event_message {EventMessage} -- Event message (a dict is converted, for convenience)
 
         Returns:
-            {dict} -- Dictionary of {'action': <str>, 'name': <str>, 'loop': <bool>} which can be passed to audiocontroller
+            {AudioCommand} -- Command which can be passed to audiocontroller, or None
         """
-        if 'component' not in event_message:
-            self._logger.error('Event message passed without "component": [%s]' % event_message)
-            return None
-
+        if type(event_message) is dict:
+            try:
+                event_message = EventMessage.fromDict(event_message)
+            except ValueError as err:
+                self._logger.error('Invalid event message: %s' % err)
+                return None
+
+        was_ready = self.panelState.controllersAreReady()
         self.panelState.processEventMessage(event_message)
         self._logger.debug(self.panelState)
 
@@ -52,24 +63,56 @@ class MessageMapper(object):
             self._logger.debug('Controllers are not ready!')
             return None
 
-        if event_message['action'] == 'stateread':
+        if event_message.action == 'stateread':
+            return None
+
+        # A state dump only announces itself when it is what made the panel ready
+        if event_message.action == 'statedump' and was_ready:
             return None
         
-        component = event_message['component']
-        self._logger.debug('Calling method for event [%s]' % event_message)
+        component = event_message.component
+        self._logger.debug('Calling method for event [%s]' % (event_message,))
 
         if component not in self.__eventMap:
             self._logger.warning('Component %s not registered. Check _configureEventMap' % component)
             return None
 
         audio_message = self.__eventMap[component](event_message)
-        if not audio_message:
-            return None
-            
-        if 'name' not in audio_message:
-            self._logger.warning('Sound lookup failed for event [%s]' % event_message)
+
+        # The shared command is only copied for the (sampled) events which are traced
+        if event_message.trace is not None and audio_message is not None:
+            event_message.trace.stamp('map')
+            audio_message = audio_message._replace(trace=event_message.trace)
         return audio_message
-        
+
+    def _command(self, event_message, name, action='play', loop=False):
+        """Returns the (shared) AudioCommand for a sound
+
+        Arguments:
+            event_message {EventMessage} -- Event the command is for (only used for logging)
+            name {str} -- Registered name of the sound, or None if there is no sound for the event
+
+        Keyword Arguments:
+            action {str} -- Audio action (default: {'play'})
+            loop {bool} -- Whether the sound should loop (default: {False})
+
+        Returns:
+            {AudioCommand} -- The command, or None if name is None
+        """
+        if name is None:
+            self._logger.warning('Sound lookup failed for event [%s]' % (event_message,))
+            return None
+
+        key = (action, name, loop)
+        command = self.__commandCache.get(key)
+        if command is None:
+            command = AudioCommand(action, name, loop)
+            self.__commandCache[key] = command
+        return command
+
+    def getRegisteredComponents(self):
+        """Returns the names of every component registered in _configureEventMap"""
+        return list(self.__eventMap.keys())
 
     def _configureEventMap(self):
         """Populates __eventMap with mappings of component names to methods that should be called when that component sends a message
@@ -118,114 +161,117 @@ class MessageMapper(object):
         self.__eventMap['switch-50-52'] = self._switchEvent
         self.__eventMap['switch-51-53'] = self._switchEvent
 
+        # Continuous inputs, aggregated by the ContinuousInputChannel
+        self.__eventMap['encoder-01'] = self._encoderEvent
+        self.__eventMap['pot-01'] = self._potEvent
+
 
     def _controllerEvent(self, event_message):
         """Transforms a incoming microcontroller event to the relevant audiocontroller message
         
         Arguments:
-            event_message {dict} -- Message dictionary as extracted from json payload of arduino message
+            event_message {EventMessage} -- Event as extracted from json payload of arduino message
 
         Returns:
-            {dict} -- Dictionary of {'action': <str>, 'name': <str>, 'loop': <bool>} which can be passed to audiocontroller
+            {AudioCommand} -- Command which can be passed to audiocontroller, or None
         """
-        audiocontroller_message = {'action': 'play', 'loop': False}
-        if event_message['component'] == 'controller01' or event_message['component'] == 'controller02':
-            audiocontroller_message['name'] = 'systems_nominal'
+        name = None
+        if event_message.component == 'controller01' or event_message.component == 'controller02':
+            name = 'systems_nominal'
 
-        return audiocontroller_message
+        return self._command(event_message, name)
 
     def _secureToggleEvent(self, event_message):
         """Transforms a incoming microcontroller event to the relevant audiocontroller message
         
         Arguments:
-            event_message {dict} -- Message dictionary as extracted from json payload of arduino message
+            event_message {EventMessage} -- Event as extracted from json payload of arduino message
 
         Returns:
-            {dict} -- Dictionary of {'action': <str>, 'name': <str>, 'loop': <bool>} which can be passed to audiocontroller
+            {AudioCommand} -- Command which can be passed to audiocontroller, or None
         """
-        audiocontroller_message = {'action': 'play', 'loop': False}
-
-        if event_message['action'] != 'statechange':
+        if event_message.action != 'statechange':
             return None
 
-        if event_message['value'] == 'PROCESSING:1':
-            audiocontroller_message['name'] = 'blip_low'
-        if event_message['value'] == 'PROCESSING:2':
-            audiocontroller_message['name'] = 'blip_medium'
-
-
-        if event_message['component'] == 'redToggle':
-            if event_message['value'] == 'WAITING:0':
-                audiocontroller_message['name'] = 'artemis_offline'
-            if event_message['value'] == 'ACTIVE:3':
-                audiocontroller_message['name'] = 'artemis_online'
-        elif event_message['component'] == 'greenToggle':
-            if event_message['value'] == 'WAITING:0':
-                audiocontroller_message['name'] = 'sensors_offline'
-            if event_message['value'] == 'ACTIVE:3':
-                audiocontroller_message['name'] = 'sensors_online'
-        elif event_message['component'] == 'blueToggle':
-            if event_message['value'] == 'WAITING:0':
-                audiocontroller_message['name'] = 'targeting_computer_offline'
-            if event_message['value'] == 'ACTIVE:3':
-                audiocontroller_message['name'] = 'targeting_computer_online'
-        return audiocontroller_message
+        name = None
+
+        if event_message.value == 'PROCESSING:1':
+            name = 'blip_low'
+        if event_message.value == 'PROCESSING:2':
+            name = 'blip_medium'
+
+
+        if event_message.component == 'redToggle':
+            if event_message.value == 'WAITING:0':
+                name = 'artemis_offline'
+            if event_message.value == 'ACTIVE:3':
+                name = 'artemis_online'
+        elif event_message.component == 'greenToggle':
+            if event_message.value == 'WAITING:0':
+                name = 'sensors_offline'
+            if event_message.value == 'ACTIVE:3':
+                name = 'sensors_online'
+        elif event_message.component == 'blueToggle':
+            if event_message.value == 'WAITING:0':
+                name = 'targeting_computer_offline'
+            if event_message.value == 'ACTIVE:3':
+                name = 'targeting_computer_online'
+        return self._command(event_message, name)
 
     def _blueButtonEvent(self, event_message):
         """Transforms a event for the big blue LED button to an audiocontroller message
         
         Arguments:
-            event_message {dict} -- Message dictionary as extracted from json payload of arduino message
+            event_message {EventMessage} -- Event as extracted from json payload of arduino message
 
         Returns:
-            {dict} -- Dictionary of {'action': <str>, 'name': <str>, 'loop': <bool>} which can be passed to audiocontroller
+            {AudioCommand} -- Command which can be passed to audiocontroller, or None
         """
-        audiocontroller_message = {'name': 'heat_warning', 'loop': True}
-
         if self.panelState.panelActiveStatus != PanelActiveStatus.ON:
-            return {'action': 'play', 'loop': False, 'name': 'systems_offline'}
+            return self._command(event_message, 'systems_offline')
 
 
-        if event_message['action'] != 'switch':
+        if event_message.action != 'switch':
             return None
 
-        if event_message['value'] == str(0):
-            audiocontroller_message['action'] = 'play'
-        elif event_message['value'] == str(1):
-            audiocontroller_message['action'] = 'stop'
+        if event_message.value == str(0):
+            return self._command(event_message, 'heat_warning', action='play', loop=True)
+        elif event_message.value == str(1):
+            return self._command(event_message, 'heat_warning', action='stop', loop=True)
 
-        return audiocontroller_message
+        return self._command(event_message, None)
         
     def _keyEvent(self, event_message):
         """Transforms a incoming key event to the relevant audiocontroller message
         
         Arguments:
-            event_message {dict} -- Message dictionary as extracted from json payload of arduino message
+            event_message {EventMessage} -- Event as extracted from json payload of arduino message
 
         Returns:
-            {dict} -- Dictionary of {'action': <str>, 'name': <str>, 'loop': <bool>} which can be passed to audiocontroller
+            {AudioCommand} -- Command which can be passed to audiocontroller, or None
         """
-        audiocontroller_message = {'action': 'play', 'loop': False}
-        if event_message['component'] != 'key':
-            self._logger.error("Component [%s] is not expected 'key'" % event_message['component'])
+        name = None
+        if event_message.component != 'key':
+            self._logger.error("Component [%s] is not expected 'key'" % event_message.component)
             return None # This should never happen
             
         if self.panelState.panelActiveStatus ==  PanelActiveStatus.INVALID:
-            if event_message['value'] == str(0):
-                audiocontroller_message['name'] = 'power_restored'
-            if event_message['value'] == str(1):
-                audiocontroller_message['name'] = 'shutdown_sequence' # this should not be able to happen
+            if event_message.value == str(0):
+                name = 'power_restored'
+            if event_message.value == str(1):
+                name = 'shutdown_sequence' # this should not be able to happen
         
         # This part looks backwards because we update the panel state before we play the sound
         elif self.panelState.panelActiveStatus ==  PanelActiveStatus.OFF:
-            if event_message['value'] == str(1):
-                audiocontroller_message['name'] = 'shutdown_sequence'
+            if event_message.value == str(1):
+                name = 'shutdown_sequence'
         elif self.panelState.panelActiveStatus ==  PanelActiveStatus.ON: 
-            if event_message['value'] == str(0):
-                audiocontroller_message['name'] = 'power_restored'
+            if event_message.value == str(0):
+                # A cue (see the audiocontroller's 'cue_list'):  The start up sequence
+                name = 'power_up'
 
-        self._logger.debug("Returning key audio message: %s" % audiocontroller_message)
-        return audiocontroller_message
+        self._logger.debug("Returning key audio sound: %s" % name)
+        return self._command(event_message, name)
 
 
     def _buttonEvent(self, event_message):
@@ -235,48 +281,48 @@ class MessageMapper(object):
         something, but releasing should be ignored
 
         Arguments:
-            event_message {dict} -- Message dictionary as extracted from json payload of arduino message
+            event_message {EventMessage} -- Event as extracted from json payload of arduino message
 
         Returns:
-            {dict} -- Dictionary of {'action': <str>, 'name': <str>, 'loop': <bool>} which can be passed to audiocontroller
+            {AudioCommand} -- Command which can be passed to audiocontroller, or None
         """
 
         # If the value is 1, this is a 'button-up' event:  Should be ignored
-        if event_message['value'] == str(1):
+        if event_message.value == str(1):
             return None
 
-        audiocontroller_message = {'action': 'play', 'loop': False}
+        name = None
 
         # "Unable to comply" if the panel is not on
         if self.panelState.panelActiveStatus != PanelActiveStatus.ON:
-            audiocontroller_message['name'] = 'systems_offline'
-            self._logger.debug('Audiocontroller Message is [%s]' % audiocontroller_message)
-            return audiocontroller_message
-
-
-        if event_message['component'] == 'switch-32':
-            audiocontroller_message['name'] = 'gauss_rifle'
-        elif event_message['component'] == 'switch-33':
-            audiocontroller_message['name'] = 'missile_launch_01'
-        elif event_message['component'] == 'switch-34':
-            audiocontroller_message['name'] = 'attacking_machinegun'
-        elif event_message['component'] == 'switch-35':
-            audiocontroller_message['name'] = 'flamethrower'
-        elif event_message['component'] == 'switch-36':
-            audiocontroller_message['name'] = 'ac10_gun'
-        elif event_message['component'] == 'switch-37':
-            audiocontroller_message['name'] = 'srm4_launch'
-        elif event_message['component'] == 'switch-38':
-            audiocontroller_message['name'] = 'laser_large'
-        elif event_message['component'] == 'switch-39':
-            audiocontroller_message['name'] = 'lbx_10'
-        elif event_message['component'] == 'switch-40':
-            audiocontroller_message['name'] = 'xpulse_large'
-        elif event_message['component'] == 'switch-41':
-            audiocontroller_message['name'] = 'laser_small'
-
-        self._logger.debug('Audiocontroller Message is [%s]' % audiocontroller_message)
-        return audiocontroller_message
+            name = 'systems_offline'
+            self._logger.debug('Audiocontroller sound is [%s]' % name)
+            return self._command(event_message, name)
+
+
+        if event_message.component == 'switch-32':
+            name = 'gauss_rifle'
+        elif event_message.component == 'switch-33':
+            name = 'missile_launch_01'
+        elif event_message.component == 'switch-34':
+            name = 'attacking_machinegun'
+        elif event_message.component == 'switch-35':
+            name = 'flamethrower'
+        elif event_message.component == 'switch-36':
+            name = 'ac10_gun'
+        elif event_message.component == 'switch-37':
+            name = 'srm4_launch'
+        elif event_message.component == 'switch-38':
+            name = 'laser_large'
+        elif event_message.component == 'switch-39':
+            name = 'lbx_10'
+        elif event_message.component == 'switch-40':
+            name = 'xpulse_large'
+        elif event_message.component == 'switch-41':
+            name = 'laser_small'
+
+        self._logger.debug('Audiocontroller sound is [%s]' % name)
+        return self._command(event_message, name)
 
 
 
@@ -284,81 +330,134 @@ class MessageMapper(object):
         """Transforms a incoming switch event to the relevant audiocontroller message
         
         Arguments:
-            event_message {dict} -- Message dictionary as extracted from json payload of arduino message
+            event_message {EventMessage} -- Event as extracted from json payload of arduino message
 
         Returns:
-            {dict} -- Dictionary of {'action': <str>, 'name': <str>, 'loop': <bool>} which can be passed to audiocontroller
+            {AudioCommand} -- Command which can be passed to audiocontroller, or None
         """
 
-        audiocontroller_message = {'action': 'play', 'loop': False}
+        name = None
         if self.panelState.panelActiveStatus != PanelActiveStatus.ON:
-            audiocontroller_message['name'] = 'systems_offline'
-            return audiocontroller_message
-
-        if event_message['component'] == 'switch-50-52' and event_message['value'] == str(1):
-            audiocontroller_message['name'] = 'reactor_online'
-        elif event_message['component'] == 'switch-50-52' and event_message['value'] == str(0):
-            audiocontroller_message['name'] = 'reactor_offline'
-        if event_message['component'] == 'switch-28' and event_message['value'] == str(1):
-            audiocontroller_message['name'] = 'beagle_engaged'
-        elif event_message['component'] == 'switch-28' and event_message['value'] == str(0):
-            audiocontroller_message['name'] = 'beagle_shutdown'
-        if event_message['component'] == 'switch-27' and event_message['value'] == str(1):
-            audiocontroller_message['name'] = 'c3_online'
-        elif event_message['component'] == 'switch-27' and event_message['value'] == str(0):
-            audiocontroller_message['name'] = 'c3_shutdown'
+            name = 'systems_offline'
+            return self._command(event_message, name)
+
+        if event_message.component == 'switch-50-52' and event_message.value == str(1):
+            name = 'reactor_online'
+        elif event_message.component == 'switch-50-52' and event_message.value == str(0):
+            name = 'reactor_offline'
+        if event_message.component == 'switch-28' and event_message.value == str(1):
+            name = 'beagle_engaged'
+        elif event_message.component == 'switch-28' and event_message.value == str(0):
+            name = 'beagle_shutdown'
+        if event_message.component == 'switch-27' and event_message.value == str(1):
+            name = 'c3_online'
+        elif event_message.component == 'switch-27' and event_message.value == str(0):
+            name = 'c3_shutdown'
             
-        elif event_message['component'] == 'switch-30' and event_message['value'] == str(1):
-            audiocontroller_message['name'] = 'data_transfer_initiated'
-        elif event_message['component'] == 'switch-30' and event_message['value'] == str(0):
-            audiocontroller_message['name'] = 'data_transfer_complete'
-        elif event_message['component'] == 'switch-31' and event_message['value'] == str(1):
-            audiocontroller_message['name'] = 'satellite_established'
-        elif event_message['component'] == 'switch-31' and event_message['value'] == str(0):
-            audiocontroller_message['name'] = 'satellite_shutdown'
-        elif event_message['component'] == 'switch-51-53' and event_message['value'] == str(2):
-            audiocontroller_message['name'] = 'linked_fire'
-        elif event_message['component'] == 'switch-51-53' and event_message['value'] == str(1):
-            audiocontroller_message['name'] = 'single_fire'
-        elif event_message['component'] == 'switch-51-53' and event_message['value'] == str(0):
-            audiocontroller_message['name'] = 'group_fire'
-        elif event_message['component'] == 'switch-42-43' and event_message['value'] == str(2):
-            audiocontroller_message['name'] = 'light_amp_maximum'
-        elif event_message['component'] == 'switch-42-43' and event_message['value'] == str(1):
-            audiocontroller_message['name'] = 'light_amp_moderate'
-        elif event_message['component'] == 'switch-42-43' and event_message['value'] == str(0):
-            audiocontroller_message['name'] = 'light_amp_nominal'
-        elif event_message['component'] == 'switch-22' and event_message['value'] == str(1):
-            audiocontroller_message['name'] = 'camera_engaged'
-        elif event_message['component'] == 'switch-22' and event_message['value'] == str(0):
-            audiocontroller_message['name'] = 'camera_offline'
-        elif event_message['component'] == 'switch-23' and event_message['value'] == str(1):
-            audiocontroller_message['name'] = 'shield_generator_active'
-        elif event_message['component'] == 'switch-23' and event_message['value'] == str(0):
-            audiocontroller_message['name'] = 'shield_generator_shutdown'
-        elif event_message['component'] == 'switch-24' and event_message['value'] == str(1):
-            audiocontroller_message['name'] = 'arm_extended'
-        elif event_message['component'] == 'switch-24' and event_message['value'] == str(0):
-            audiocontroller_message['name'] = 'arm_retracted'
-        elif event_message['component'] == 'switch-25' and event_message['value'] == str(1):
-            audiocontroller_message['name'] = 'ams_engaged'
-        elif event_message['component'] == 'switch-25' and event_message['value'] == str(0):
-            audiocontroller_message['name'] = 'ams_offline'
-        elif event_message['component'] == 'switch-26' and event_message['value'] == str(1):
-            audiocontroller_message['name'] = 'ecm_online'
-        elif event_message['component'] == 'switch-26' and event_message['value'] == str(0):
-            audiocontroller_message['name'] = 'ecm_offline'
-        elif event_message['component'] == 'switch-29' and event_message['value'] == str(1):
-            audiocontroller_message['name'] = 'power_converter_online'
-        elif event_message['component'] == 'switch-29' and event_message['value'] == str(0):
-            audiocontroller_message['name'] = 'power_converter_offline'
-
-
-
-
-        self._logger.debug('Audiocontroller Message is [%s]' % audiocontroller_message)
-        return audiocontroller_message
+        elif event_message.component == 'switch-30' and event_message.value == str(1):
+            name = 'data_transfer_initiated'
+        elif event_message.component == 'switch-30' and event_message.value == str(0):
+            name = 'data_transfer_complete'
+        elif event_message.component == 'switch-31' and event_message.value == str(1):
+            name = 'satellite_established'
+        elif event_message.component == 'switch-31' and event_message.value == str(0):
+            name = 'satellite_shutdown'
+        elif event_message.component == 'switch-51-53' and event_message.value == str(2):
+            name = 'linked_fire'
+        elif event_message.component == 'switch-51-53' and event_message.value == str(1):
+            name = 'single_fire'
+        elif event_message.component == 'switch-51-53' and event_message.value == str(0):
+            name = 'group_fire'
+        elif event_message.component == 'switch-42-43' and event_message.value == str(2):
+            name = 'light_amp_maximum'
+        elif event_message.component == 'switch-42-43' and event_message.value == str(1):
+            name = 'light_amp_moderate'
+        elif event_message.component == 'switch-42-43' and event_message.value == str(0):
+            name = 'light_amp_nominal'
+        elif event_message.component == 'switch-22' and event_message.value == str(1):
+            name = 'camera_engaged'
+        elif event_message.component == 'switch-22' and event_message.value == str(0):
+            name = 'camera_offline'
+        elif event_message.component == 'switch-23' and event_message.value == str(1):
+            # A phrase (see the audiocontroller's 'phrase_list'):  'scan completed', then 'shield generator active'
+            name = 'scan_completed_shield_active'
+        elif event_message.component == 'switch-23' and event_message.value == str(0):
+            name = 'shield_generator_shutdown'
+        elif event_message.component == 'switch-24' and event_message.value == str(1):
+            name = 'arm_extended'
+        elif event_message.component == 'switch-24' and event_message.value == str(0):
+            name = 'arm_retracted'
+        elif event_message.component == 'switch-25' and event_message.value == str(1):
+            name = 'ams_engaged'
+        elif event_message.component == 'switch-25' and event_message.value == str(0):
+            name = 'ams_offline'
+        elif event_message.component == 'switch-26' and event_message.value == str(1):
+            name = 'ecm_online'
+        elif event_message.component == 'switch-26' and event_message.value == str(0):
+            name = 'ecm_offline'
+        elif event_message.component == 'switch-29' and event_message.value == str(1):
+            name = 'power_converter_online'
+        elif event_message.component == 'switch-29' and event_message.value == str(0):
+            name = 'power_converter_offline'
+
+
+
+
+        self._logger.debug('Audiocontroller sound is [%s]' % name)
+        return self._command(event_message, name)
+
+    def _encoderEvent(self, event_message):
+        """Transforms an aggregated encoder delta to a single click
+
+        Events arrive at most once per sample interval, so a slow turn clicks once per detent,
+        and a fast spin clicks once per sample rather than once per detent
+
+        Arguments:
+            event_message {EventMessage} -- Aggregated 'delta' event from the ContinuousInputChannel
+
+        Returns:
+            {AudioCommand} -- Command which can be passed to audiocontroller, or None
+        """
+        if event_message.action != 'delta' or self.panelState.panelActiveStatus != PanelActiveStatus.ON:
+            return None
+
+        try:
+            delta = int(event_message.value)
+        except (TypeError, ValueError):
+            self._logger.error('Invalid encoder delta [%s]' % (event_message,))
+            return None
+
+        if delta > 0:
+            return self._command(event_message, 'rotary_encoder_up')
+        if delta < 0:
+            return self._command(event_message, 'rotary_encoder_down')
+        return None
+
+    def _potEvent(self, event_message):
+        """Plays a blip when a pot moves into another third of its (10 bit) range
+
+        Arguments:
+            event_message {EventMessage} -- Aggregated 'analog' event from the ContinuousInputChannel
+
+        Returns:
+            {AudioCommand} -- Command which can be passed to audiocontroller, or None
+        """
+        if event_message.action != 'analog':
+            return None
+
+        try:
+            band = min(int(event_message.value) * 3 // 1024, 2)
+        except (TypeError, ValueError):
+            self._logger.error('Invalid pot reading [%s]' % (event_message,))
+            return None
+
+        previous_band = self.__analogBands.get(event_message.component)
+        self.__analogBands[event_message.component] = band
+        if previous_band is None or band == previous_band or \
+           self.panelState.panelActiveStatus != PanelActiveStatus.ON:
+            return None
 
+        return self._command(event_message, ('blip_low', 'blip_medium', 'blip_high')[band])
 
 
 
@@ -0,0 +1,253 @@
+"""Microbenchmarks for MessageMapper and PanelState
+
+Builds a synthetic event corpus covering every component registered in
+MessageMapper._configureEventMap, in every PanelActiveStatus, and measures events per
+second, objects retained per event, and (on Python 3.9+, through tracemalloc) bytes
+allocated per event for:
+
+    MessageMapper.getAudiocontrollerMessageForEvent
+    PanelState.processEventMessage
+
+Events per second come from the fastest of several timed rounds, after a warm up round, so
+a single slow round (another process, a cold cache) doesn't show up as a regression.
+
+Python 2 has no way of counting allocations as they happen:  gc.get_count() goes down again
+as objects are freed, so it only shows what is left over, which objects_per_event already
+measures.  There, bytes_per_event is null, and the output says why.
+
+Results are written as json, and can be compared against a saved baseline:
+
+    python -m serialprocessor.messagemapper_benchmark --output results.json
+    python -m serialprocessor.messagemapper_benchmark --baseline results.json --threshold 10
+
+The exit code is 1 if any result regressed by more than the threshold (in percent).
+"""
+
+import argparse
+import gc
+import json
+import logging
+import platform
+import sys
+import timeit
+
+from messagemapper import MessageMapper
+from panelstate import PanelState, PanelActiveStatus
+from pipeline.messages import EventMessage
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python 2:  Objects retained are measured, bytes allocated aren't
+
+NO_ALLOCATIONS = 'bytes_per_event needs tracemalloc.reset_peak (Python 3.9+), not measured on Python %s'
+
+
+SECURE_TOGGLE_VALUES = ['WAITING:0', 'PROCESSING:1', 'PROCESSING:2', 'ACTIVE:3']
+SWITCH_VALUES = ['0', '1', '2']
+
+
+def buildCorpus(mapper):
+    """Returns a list of EventMessages covering every registered component and its values
+
+    Arguments:
+        mapper {MessageMapper} -- Mapper whose registered components are covered
+
+    Returns:
+        {list} -- List of EventMessage
+    """
+    corpus = []
+    for component in sorted(mapper.getRegisteredComponents()):
+        if component.startswith('controller'):
+            corpus.append(EventMessage('setup_complete', component))
+        elif component.endswith('Toggle'):
+            for value in SECURE_TOGGLE_VALUES:
+                corpus.append(EventMessage('statechange', component, value))
+        else:
+            for value in SWITCH_VALUES:
+                corpus.append(EventMessage('switch', component, value))
+            if component == 'key':
+                corpus.append(EventMessage('stateread', component, '1'))
+    return corpus
+
+
+def _readyMapper():
+    mapper = MessageMapper(log_level=logging.CRITICAL)
+    mapper.getAudiocontrollerMessageForEvent(EventMessage('setup_complete', 'controller01'))
+    mapper.getAudiocontrollerMessageForEvent(EventMessage('setup_complete', 'controller02'))
+    return mapper
+
+
+def _runPasses(target, panel_state, corpus, repeat):
+    """Runs every event of the corpus through target, once per PanelActiveStatus per repeat"""
+    for _ in range(repeat):
+        for status in PanelActiveStatus:
+            # Key events move the status along, so every pass starts from a known one
+            panel_state.panelActiveStatus = status
+            for event in corpus:
+                target(event)
+
+
+def _measureAllocations(target, panel_state, corpus):
+    """Returns the average number of bytes allocated while handling one event
+
+    The traced peak is reset before each event, so short lived allocations (which are
+    freed again before the next event) are counted too
+    """
+    total = 0
+    tracemalloc.start()
+    for status in PanelActiveStatus:
+        panel_state.panelActiveStatus = status
+        for event in corpus:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            target(event)
+            total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return float(total) / (len(corpus) * len(PanelActiveStatus))
+
+
+def _measureRetainedObjects(target, panel_state, corpus, repeat):
+    """Returns the average number of objects still alive after handling one event
+
+    Counts the objects tracked by the garbage collector (after a full collection) before
+    and after the passes, so it works on every Python.  Only containers are tracked, not
+    strings or numbers.  Anything above zero is state which grows with every event, e.g.
+    an unbounded cache
+    """
+    gc.collect()
+    before = len(gc.get_objects())
+    _runPasses(target, panel_state, corpus, repeat)
+    gc.collect()
+    retained = len(gc.get_objects()) - before
+    return float(retained) / (len(corpus) * len(PanelActiveStatus) * repeat)
+
+
+def _timeRounds(target, panel_state, corpus, repeat, rounds):
+    """Returns the seconds each round of passes took, after an untimed warm up round
+
+    timeit keeps the garbage collector off while a round runs, so a collection which
+    happens to fall into one round doesn't make it look slow
+    """
+    _runPasses(target, panel_state, corpus, repeat)
+    return timeit.repeat(lambda: _runPasses(target, panel_state, corpus, repeat),
+                         repeat=rounds, number=1)
+
+
+def _measure(target, panel_state, corpus, repeat, rounds):
+    """Measures events per second (in the fastest round), objects retained per event, and
+    (where tracemalloc can reset its peak) bytes allocated per event"""
+    num_events = len(corpus) * len(PanelActiveStatus) * repeat
+
+    times = sorted(_timeRounds(target, panel_state, corpus, repeat, rounds))
+
+    result = {'events': num_events,
+              'rounds': rounds,
+              'seconds': times[0],
+              'seconds_median': times[len(times) // 2],
+              'events_per_second': num_events / times[0],
+              'objects_per_event': _measureRetainedObjects(target, panel_state, corpus, repeat),
+              'bytes_per_event': None}
+
+    if tracemalloc is not None and hasattr(tracemalloc, 'reset_peak'):
+        result['bytes_per_event'] = _measureAllocations(target, panel_state, corpus)
+
+    return result
+
+
+def runBenchmarks(repeat=200, rounds=7):
+    """Runs all of the benchmarks
+
+    Keyword Arguments:
+        repeat {int} -- Number of times the corpus is run through per round, per PanelActiveStatus (default: {200})
+        rounds {int} -- Number of timed rounds;  the fastest one counts (default: {7})
+
+    Returns:
+        {dict} -- Results, keyed by benchmark name
+    """
+    mapper = _readyMapper()
+    corpus = buildCorpus(mapper)
+
+    panel_state = PanelState(log_level=logging.CRITICAL)
+
+    return {
+        'messagemapper': _measure(mapper.getAudiocontrollerMessageForEvent, mapper.panelState, corpus, repeat, rounds),
+        'panelstate': _measure(panel_state.processEventMessage, panel_state, corpus, repeat, rounds)
+    }
+
+
+def compareToBaseline(results, baseline, threshold):
+    """Compares results against a baseline
+
+    Arguments:
+        results {dict} -- Results from runBenchmarks
+        baseline {dict} -- Results loaded from an earlier run
+        threshold {float} -- Percentage by which a result may be worse than the baseline
+
+    Returns:
+        {list} -- Descriptions of every regression beyond the threshold
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+
+        slowdown = 100.0 * (old['events_per_second'] - result['events_per_second']) / old['events_per_second']
+        if slowdown > threshold:
+            regressions.append('%s: %.0f events/s vs. baseline %.0f (%.1f%% slower)'
+                               % (name, result['events_per_second'], old['events_per_second'], slowdown))
+
+        # The baseline is usually zero, so growth is measured against at least one object per event
+        if old.get('objects_per_event') is not None:
+            growth = 100.0 * (result['objects_per_event'] - old['objects_per_event']) / max(old['objects_per_event'], 1.0)
+            if growth > threshold:
+                regressions.append('%s: %.2f objects retained/event vs. baseline %.2f'
+                                   % (name, result['objects_per_event'], old['objects_per_event']))
+
+        if result['bytes_per_event'] is not None and old.get('bytes_per_event'):
+            growth = 100.0 * (result['bytes_per_event'] - old['bytes_per_event']) / old['bytes_per_event']
+            if growth > threshold:
+                regressions.append('%s: %.1f bytes/event vs. baseline %.1f (%.1f%% more)'
+                                   % (name, result['bytes_per_event'], old['bytes_per_event'], growth))
+    return regressions
+
+
+def parse_arguments(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", dest="output",
+                        help="Write the results to this json file")
+    parser.add_argument("-b", "--baseline", dest="baseline",
+                        help="Compare the results against this json file")
+    parser.add_argument("-t", "--threshold", dest="threshold", type=float, default=10.0,
+                        help="Allowed regression against the baseline, in percent")
+    parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=200,
+                        help="Number of passes over the corpus per panel status, per round")
+    parser.add_argument("-n", "--rounds", dest="rounds", type=int, default=7,
+                        help="Number of timed rounds, the fastest of which counts")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+
+    results = runBenchmarks(args.repeat, args.rounds)
+    report = {'python': platform.python_version(), 'results': results}
+    if tracemalloc is None or not hasattr(tracemalloc, 'reset_peak'):
+        report['note'] = NO_ALLOCATIONS % platform.python_version()
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compareToBaseline(results, baseline, args.threshold)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        if regressions:
+            sys.exit(1)
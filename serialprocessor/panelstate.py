@@ -9,6 +9,20 @@ class PanelActiveStatus(Enum):
     INVALID = 3 # The key is in the ON position, but came up like that on system wakeup
 
 
+# Indicators driven from the panel state (see component-dimensions.md)
+LED_BARS = ['ledbar-01', 'ledbar-02']                       # F: Dual LED bars, value is the number of lit segments
+LED_BAR_SEGMENTS = 10
+LED_BUTTONS = ['switch-07'] + ['switch-%02d' % n for n in range(32, 42)]   # D, E: LED arcade buttons, '1' lit
+DISPLAYS = ['display-%02d' % n for n in range(1, 7)]        # M, N: 4 digit 7-segment readouts
+
+# Which controller drives each indicator.  Its commands only go to that controller's port
+INDICATOR_CONTROLLERS = dict([(component, 'controller01') for component in LED_BUTTONS + LED_BARS] +
+                             [(component, 'controller02') for component in DISPLAYS])
+
+# What the displays read for each PanelActiveStatus
+DISPLAY_TEXT = {'ON': '  On', 'OFF': '    ', 'INVALID': '----'}
+
+
 class PanelState(object):
 
     _logger = logging.getLogger()
@@ -24,58 +38,130 @@ class PanelState(object):
         self._controller01Ready = False
         self._controller02Ready = False
 
+        # Last reported value of every component, e.g. {'switch-22': '1'}
+        self.componentValues = {}
+
     def __str__(self):
         return "Controllers: [%s/%s] PanelActive: %s" % (self._controller01Ready, self._controller02Ready, self.panelActiveStatus)
 
     def controllersAreReady(self):
         return self._controller01Ready and self._controller02Ready
 
+    def getIndicatorCommands(self):
+        """Returns the commands which bring the controllers' LEDs and displays in line with this state
+
+        The LED buttons and bars are lit only while the panel is ON.  The displays are blank
+        while it is OFF, and read '----' while the key needs turning off and on again (INVALID)
+
+        Returns:
+            {list} -- List of {'component': <str>, 'value': <str>} commands, for the controllers' command queues
+        """
+        active = self.panelActiveStatus == PanelActiveStatus.ON
+        commands = [{'component': component, 'value': '1' if active else '0'} for component in LED_BUTTONS]
+        commands += [{'component': component, 'value': str(LED_BAR_SEGMENTS if active else 0)} for component in LED_BARS]
+        commands += [{'component': component, 'value': DISPLAY_TEXT[self.panelActiveStatus.name]} for component in DISPLAYS]
+        return commands
+
     # {u'action': u'setup_complete', u'component': u'controller01', u'value': u'n/a', u'element': u'n/a'}
     def _processControllerEventMessage(self, event_message):
         """For handling panel state
         
         Arguments:
-            event_message {dict} -- Message dictionary as extracted from json payload of arduino message
+            event_message {EventMessage} -- Event as extracted from json payload of arduino message
         """
-        if event_message['component'] == 'controller01' and event_message['action'] == 'setup_complete':
+        if event_message.component == 'controller01' and event_message.action == 'setup_complete':
             self._logger.debug("Setting controller01Ready to True")
             self._controller01Ready = True
-        elif event_message['component'] == 'controller02' and event_message['action'] == 'setup_complete':
+        elif event_message.component == 'controller02' and event_message.action == 'setup_complete':
             self._logger.debug("Setting controller02Ready to True")
             self._controller02Ready = True
 
 
+    # {u'action': u'statedump', u'component': u'controller01', u'value': {u'key': u'1', u'switch-22': u'0', ...}}
+    def _processStateDump(self, event_message):
+        """Applies a controller's full state dump (its answer to a statedump_request) in one go
+
+        The dump stands in for setup_complete:  The controller is ready.  The key position is
+        compared with the panel's status, since the key may have been turned while the
+        controller was disconnected.  Nothing is applied unless the whole dump is valid
+
+        Arguments:
+            event_message {EventMessage} -- 'statedump' event, whose value is a {component: value} dict
+        """
+        if event_message.component not in ('controller01', 'controller02'):
+            self._logger.error("State dump from unknown controller [%s]" % event_message.component)
+            return
+
+        dump = event_message.value
+        if type(dump) is not dict:
+            self._logger.error("Improperly structured state dump: %s" % (event_message,))
+            return
+        values = dict((component, str(value)) for component, value in dump.items())
+
+        if 'key' in values:
+            self._applyDumpedKey(values['key'])
+        self.componentValues.update(values)
+        if event_message.component == 'controller01':
+            self._controller01Ready = True
+        else:
+            self._controller02Ready = True
+        self._logger.debug("Applied state dump from %s: %s" % (event_message.component, values))
+
+    def _applyDumpedKey(self, value):
+        """Brings the panel status in line with the key position reported in a state dump
+
+        A key found OFF turns the panel OFF.  A key found ON only turns it ON if it was OFF
+        (it was switched on while the controller was disconnected);  an INVALID panel stays
+        INVALID, just like a key which is ON at wakeup
+
+        Arguments:
+            value {str} -- Key position, '0' for ON and '1' for OFF
+        """
+        if value == str(1):
+            self.panelActiveStatus = PanelActiveStatus.OFF
+        elif value == str(0) and self.panelActiveStatus == PanelActiveStatus.OFF:
+            self.panelActiveStatus = PanelActiveStatus.ON
+        elif value not in (str(0), str(1)):
+            self._logger.error("Invalid key position [%s] in state dump" % value)
+
     def _processKeyEventMessage(self, event_message):
         
         # We don't want to process any key event messages unless the controllers are set up
         try:
-            if event_message['action'] == 'stateread' and event_message['value'] == str(0):
+            if event_message.action == 'stateread' and event_message.value == str(0):
                 return
-            elif event_message['action'] == 'stateread' and event_message['value'] == str(1):
+            elif event_message.action == 'stateread' and event_message.value == str(1):
                 self.panelActiveStatus = PanelActiveStatus.OFF
-            elif event_message['action'] == 'switch' and event_message['value'] == str(0):
+            elif event_message.action == 'switch' and event_message.value == str(0):
                 self.panelActiveStatus = PanelActiveStatus.ON
-            elif event_message['action'] == 'switch' and event_message['value'] == str(1):
+            elif event_message.action == 'switch' and event_message.value == str(1):
                 self.panelActiveStatus = PanelActiveStatus.OFF
-        except KeyError:
-            self._logger.error("Received improperly formed event message: %s" % event_message)
+        except AttributeError:
+            self._logger.error("Received improperly formed event message: %s" % (event_message,))
             return
 
     def processEventMessage(self, event_message):
         """Takes in an event message dictionary and updates the state of the panel accordingly
         
         Arguments:
-            event_message {dict} -- Message dictionary as extracted from json payload of arduino message
+            event_message {EventMessage} -- Event as extracted from json payload of arduino message
         """
         try:
-            if event_message['component'] == 'controller01' or event_message['component'] == 'controller02':
+            if event_message.action == 'statedump':
+                self._processStateDump(event_message)
+                return
+
+            if event_message.component == 'controller01' or event_message.component == 'controller02':
                 self._processControllerEventMessage(event_message)
-            elif event_message['component'] == 'key':
+            elif event_message.component == 'key':
                 self._processKeyEventMessage(event_message)
 
+            if event_message.value != 'n/a':
+                self.componentValues[event_message.component] = event_message.value
+
 
         
-        except KeyError:
-            self._logger.error("Received event message without 'component' key: %s" % event_message)
+        except AttributeError:
+            self._logger.error("Received event message without 'component': %s" % (event_message,))
             return
 
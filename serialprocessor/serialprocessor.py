@@ -11,8 +11,19 @@ import logging
 import json
 import os
 import Queue
-import serial
 import threading
+import time
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+from commandwriter import CommandWriter
+from continuousinput import ContinuousInputChannel
+from pipeline.messages import EventMessage
+from pipeline.realtime import enterRealtime
+from pipeline.tracing import Tracer
 
 
 logger = logging.getLogger()
@@ -20,7 +31,8 @@ logger.setLevel(logging.DEBUG)
 
 
 def serial_processor_worker(serial_name, audio_controller_queue,
-                            logger=logging.getLogger()):
+                            logger=logging.getLogger(), heartbeat=None, command_queue=None,
+                            trace_sample_every=0, realtime=None):
     """ Generates a SerialProcessor and sets it to start monitoring the port
     
     Arguments:
@@ -29,10 +41,23 @@ def serial_processor_worker(serial_name, audio_controller_queue,
     
     Keyword Arguments:
         logger {logging.Logger} -- Logging object (default: {logging.getLogger()})
+        heartbeat {Heartbeat} -- Beaten from the read loop, so a supervisor can tell we're alive (default: {None})
+        command_queue {multiprocessing.Queue} -- Commands ({'component', 'value'}) to write to the controller (default: {None})
+        trace_sample_every {int} -- Trace every n'th event through the pipeline, 0 for no tracing (default: {0})
+        realtime {dict} -- Real-time config for the worker, see pipeline/realtime.py (default: {None})
     """
  
-    serialProcessor = SerialProcessor( config = {'port_path': serial_name}, audio_controller_queue = audio_controller_queue)
-    serialProcessor.startSerialListening()
+    # With a heartbeat, reads must time out so that we keep beating while the panel is idle
+    read_timeout = None
+    if heartbeat:
+        read_timeout = 1.0
+
+    serialProcessor = SerialProcessor( config = {'port_path': serial_name}, audio_controller_queue = audio_controller_queue,
+                                       read_timeout = read_timeout, command_queue = command_queue,
+                                       tracer = Tracer(trace_sample_every))
+    if realtime:
+        enterRealtime(realtime, 'serial %s' % serial_name)
+    serialProcessor.startSerialListening(heartbeat)
 
 
 
@@ -48,7 +73,13 @@ class SerialProcessor:
     # Config is dict:  { 'port_paths': []}
     def __init__(self, config, audio_controller_queue,
                  controller_baud=19200,
-                 log_level=logging.WARNING):
+                 log_level=logging.WARNING,
+                 read_timeout=None,
+                 command_queue=None,
+                 tracer=None,
+                 frame_interval=0.05,
+                 sample_interval=0.05,
+                 state_dump_retry=1.0):
         """Initialize the SerialProcessor object
         
         Arguments:
@@ -58,6 +89,12 @@ class SerialProcessor:
         Keyword Arguments:
             controller_baud {int} -- Connection speed for the serial ports (default: {19200})
             log_level {logging.LogLevel} -- Log level (default: {logging.WARNING})
+            read_timeout {float} -- Seconds a read waits for a line, None to wait forever (default: {None})
+            command_queue {multiprocessing.Queue} -- Commands ({'component', 'value'}) to write to the controller (default: {None})
+            tracer {Tracer} -- Picks the events which are traced through the pipeline (default: {None})
+            frame_interval {float} -- Seconds between batched writes to the controller (default: {0.05})
+            sample_interval {float} -- Seconds between samples of the encoders and pots (default: {0.05})
+            state_dump_retry {float} -- Seconds between state dump requests, until the controller answers one (default: {1.0})
         
         example usage:
 
@@ -76,6 +113,7 @@ class SerialProcessor:
         self._logger.debug('Inside SerialProcessor constructor')
         self._controller_baud = controller_baud
         self._audio_controller_queue = audio_controller_queue
+        self._tracer = tracer
 
 
         # Paths to serial ports
@@ -85,33 +123,145 @@ class SerialProcessor:
 
         
         # self._serial_port <serial.Serial> object>
+        if serial is None:
+            raise ImportError('pyserial is required for the SerialProcessor')
         self._logger.info('Connecting serial port at %s' % self._port_path)
-        self._serial_port = serial.Serial(self._port_path, self._controller_baud, timeout=None)
+        self._serial_port = serial.Serial(self._port_path, self._controller_baud, timeout=read_timeout)
+        self._read_timeout = read_timeout
 
-    def startSerialListening(self):
-        """This is a blocking call that will just start listening on the port specified by the item in port_path
+        # Start of a line whose end hasn't been read yet
+        self._partial = b''
+
+        # Outbound commands (LEDs, displays) are batched and written once per frame
+        self._frame_interval = frame_interval
+        self.commandWriter = CommandWriter(self._serial_port, frame_interval, command_queue)
+
+        # Encoders and pots bypass the json path, and are aggregated before going on the queue
+        self._sample_interval = sample_interval
+        self.continuousInput = ContinuousInputChannel(audio_controller_queue, sample_interval)
+
+        # When service() is next due to write a frame, and to sample the continuous inputs
+        self._next_frame = self._next_sample = time.time()
+
+        # When the state dump request is due to be sent again, None once the controller answered
+        self._state_dump_retry = state_dump_retry
+        self._state_dump_due = None
+
+    def setReadTimeout(self, read_timeout):
+        """Changes how long a read waits for data (None to wait forever, 0 to never wait)
+
+        Reconfiguring the port is a system call, so it is only done when the timeout changes
         """
-        while True:
-            line = self._serial_port.readline()
-            if not line:
-                continue
+        if read_timeout != self._read_timeout:
+            self._serial_port.timeout = read_timeout
+            self._read_timeout = read_timeout
+
+    def requestStateDump(self):
+        """Asks the controller for a 'statedump', and keeps asking until it answers
 
-            try:
-                logger.debug("Message recived on %s: %s" % (self._port_path, line))
-                event_message = SerialProcessor.processJson(self._port_path, line)
-                logger.debug("Post processing on %s: [%s]"  % (self._port_path, event_message))
+        Opening the port resets an Arduino, and whatever is sent while its bootloader runs is
+        lost.  So the request is sent again every state_dump_retry seconds (by readLines),
+        until a 'statedump', or a 'setup_complete', comes back
+        """
+        self.commandWriter.requestStateDump()
+        self._state_dump_due = time.time() + self._state_dump_retry
 
-                if self._audio_controller_queue:
-                    logger.debug("Publishing message onto audio_controller_queue")
-                    self._audio_controller_queue.put(event_message)
+    def _checkStateDump(self, lines):
+        for line in lines:
+            if b'"statedump"' in line or b'"setup_complete"' in line:
+                self._state_dump_due = None
+                return
+        if time.time() >= self._state_dump_due:
+            self._logger.info('No state dump from %s yet, asking again' % self._port_path)
+            self.requestStateDump()
 
-            except KeyError as ke:
-                logger.error("KeyError - serialInfo %s improperly structured"
-                            % line)
-                logger.error("%s" % ke)
-            except TypeError as err:
-                logger.error("Got type error: %s" % err)
-                pass
+    def readLines(self):
+        """Reads whatever has arrived (waiting up to the read timeout for the first byte), and
+        returns the complete json lines
+
+        Encoder and pot lines are fed to the continuous input channel instead of being
+        returned.  A line which is only partly read is kept until the rest of it arrives
+
+        Returns:
+            {list} -- Complete lines (bytes, with their newline), possibly none
+        """
+        data = self._serial_port.read(max(1, self._serial_port.in_waiting))
+        lines = []
+        if data:
+            lines = (self._partial + data).split(b'\n')
+            self._partial = lines.pop()
+            lines = [line for line in lines if line.strip() and not self.continuousInput.feed(line)]
+
+        if self._state_dump_due is not None:
+            self._checkStateDump(lines)
+        return lines
+
+    def service(self):
+        """Does the outbound work for callers which poll the processor from a single thread,
+        rather than calling startSerialListening (which runs it on threads of its own):  Writes
+        a frame of commands, and samples the continuous inputs, each once per interval
+        """
+        now = time.time()
+        if now >= self._next_frame:
+            self.commandWriter.flush()
+            self._next_frame = now + self._frame_interval
+        if now >= self._next_sample:
+            self.continuousInput.sample()
+            self._next_sample = now + self._sample_interval
+
+    def close(self):
+        """Writes any pending commands, and closes the port"""
+        self.commandWriter.flush()
+        self._serial_port.close()
+
+    def startSerialListening(self, heartbeat=None):
+        """This is a blocking call that will just start listening on the port specified by the item in port_path
+
+        Keyword Arguments:
+            heartbeat {Heartbeat} -- Beaten after every read (or read timeout) (default: {None})
+        """
+        self.commandWriter.start()
+        self.continuousInput.start()
+
+        # The controller answers with a 'statedump', so the panel is ready after one round trip
+        # rather than whenever the controller next happens to send setup_complete
+        self.requestStateDump()
+        read_timeout = self._read_timeout
+        tracing = self._tracer is not None and self._tracer.enabled
+        while True:
+            # Until the controller answers, reads time out in time to ask again
+            if self._state_dump_due is not None and (read_timeout is None or read_timeout > self._state_dump_retry):
+                self.setReadTimeout(self._state_dump_retry)
+            else:
+                self.setReadTimeout(read_timeout)
+            lines = self.readLines()
+            if tracing:
+                read_time = time.time()
+            if heartbeat:
+                heartbeat.beat()
+
+            for line in lines:
+                # Only json lines are sampled, so timeouts and encoder lines don't use up samples
+                trace = None
+                if tracing:
+                    trace = self._tracer.begin(read_time)
+
+                try:
+                    logger.debug("Message recived on %s: %s" % (self._port_path, line))
+                    event_message = SerialProcessor.processJson(self._port_path, line, trace)
+                    logger.debug("Post processing on %s: [%s]"  % (self._port_path, event_message))
+
+                    if self._audio_controller_queue:
+                        logger.debug("Publishing message onto audio_controller_queue")
+                        self._audio_controller_queue.put(event_message)
+
+                except KeyError as ke:
+                    logger.error("KeyError - serialInfo %s improperly structured"
+                                % line)
+                    logger.error("%s" % ke)
+                except TypeError as err:
+                    logger.error("Got type error: %s" % err)
+                    pass
 
 
     @staticmethod
@@ -120,7 +270,7 @@ class SerialProcessor:
 
 
     @staticmethod
-    def processJson(serial_name, msg_json):
+    def processJson(serial_name, msg_json, trace=None):
         """This actually converts the json messages from the arduino to the audio control messages
 
         The way this is constructed now, if we want to maintain state for the panel, we will need
@@ -130,18 +280,23 @@ class SerialProcessor:
         Arguments:
             serial_name {str} -- Name of the serial connection over which the json messages were recieved (only used for logging)
             msg_json {str} -- The json object sent in over the specified serial connection
+
+        Keyword Arguments:
+            trace {Trace} -- Trace for the event, if it was sampled (default: {None})
         
         Returns:
-            [dict] -- Message to be passed to the audio controller.  Has keys 'name', 'action', and 'loop'
+            [EventMessage] -- Event to be passed on to the MessageMapper, or None if the message was invalid
         """
 
-        SerialProcessor._logger.debug("processJson:%s: %s"
-                                      % (serial_name, msg_json))
+        # Called for every event (the pipeline's ParseStage uses it too), so the log
+        # messages are only formatted if they are actually logged
+        SerialProcessor._logger.debug("processJson:%s: %s", serial_name, msg_json)
         try:
-            SerialProcessor._logger.debug("Type of json_message is %s"
-                                          % type(msg_json))
-            event_message = json.loads(msg_json.decode('utf-8'))
-            SerialProcessor._logger.info("Message: %s" % event_message)
+            SerialProcessor._logger.debug("Type of json_message is %s", type(msg_json))
+            event_message = EventMessage.fromDict(json.loads(msg_json.decode('utf-8')), trace)
+            if trace is not None:
+                trace.stamp('parse')
+            SerialProcessor._logger.info("Message: %s", event_message)
 
             #audio_command = SerialProcessor._message_mapper.getAudiocontrollerMessageForEvent(event_message)
 